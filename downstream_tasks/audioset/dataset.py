@@ -4,6 +4,8 @@ import torch
 import torchvision.io
 from torch.utils.data.dataset import Dataset
 
+from utils.preprocess import RawInput
+
 
 class AudiosetDataset(Dataset):
     def __init__(
@@ -21,8 +23,18 @@ class AudiosetDataset(Dataset):
         csvpath = "/".join([self.csv_root, csvname])
         with open(csvpath) as csvfile:
             self.data = list(csv.reader(csvfile))
+        # the labels of sample idx are label_indices[label_offsets[idx]:label_offsets[idx + 1]]
+        label_lists = [[int(i) for i in row[3:]] for row in self.data]
+        self.label_offsets = torch.tensor(
+            [0] + [len(labels) for labels in label_lists], dtype=torch.long
+        ).cumsum(dim=0)
+        self.label_indices = torch.tensor(
+            [i for labels in label_lists for i in labels], dtype=torch.int16
+        )
         self.preprocess = preprocess
         self.preprocess_audio = preprocess_audio
+        # preprocessed features are not cached for --batched_preprocess, whose samples are raw clips
+        self.feature_cache = not isinstance(preprocess_audio, RawInput)
         self.preprocess_video = preprocess_video
         self.upstream_name = kwargs["upstream"]
         self.upstream_feature_selection = kwargs["upstream_feature_selection"]
@@ -36,13 +48,7 @@ class AudiosetDataset(Dataset):
         )
         filepath = "/".join([self.audioset_root, filename])
         basename = filepath.rsplit("/")[-1].rsplit(".")[0]
-        origin_labels = [int(i) for i in self.data[idx][3:]]
-        labels = []
-        for i in range(self.class_num):
-            if i not in origin_labels:
-                labels.append(0)
-            else:
-                labels.append(1)
+        labels = self.get_labels(idx)
 
         if self.pooled_features_path:
             pooled_feature_path = f"{self.pooled_features_path}/{self.upstream_name}_{self.upstream_feature_selection}/{basename}_pooled.pt"
@@ -51,7 +57,8 @@ class AudiosetDataset(Dataset):
                 return pooled_feature, pooled_feature, labels, True
 
         feature_path = f"/work/u7196393/features/{self.upstream_name}/{basename}.pt"
-        if not os.path.exists(feature_path):
+        load_feature = self.feature_cache and os.path.exists(feature_path)
+        if not load_feature:
             filename = "_".join(
                 [
                     self.data[idx][0] + ".mp4",
@@ -64,7 +71,7 @@ class AudiosetDataset(Dataset):
             )
             wav = wav.mean(dim=0).squeeze(0)
             audio_sr, video_fps = meta["audio_fps"], meta["video_fps"]
-        if os.path.exists(feature_path):
+        if load_feature:
             processed_wav, processed_frames = torch.load(feature_path)
         else:
             if self.preprocess is not None:
@@ -89,6 +96,15 @@ class AudiosetDataset(Dataset):
             # torch.save([processed_wav, processed_frames], feature_path)
         return processed_wav, processed_frames, labels, basename
 
+    def get_labels(self, idx):
+        """
+        The multi-hot (class_num,) uint8 labels of sample idx
+        """
+        labels = torch.zeros(self.class_num, dtype=torch.uint8)
+        start, end = self.label_offsets[idx], self.label_offsets[idx + 1]
+        labels[self.label_indices[start:end].long()] = 1
+        return labels
+
     def __len__(self):
         return len(self.data)
 
@@ -6,9 +6,7 @@ import random
 import numpy as np
 import torch
 import torch.nn as nn
-from sklearn.metrics import average_precision_score
 from torch.distributed import is_initialized
-from torch.nn.utils.rnn import pad_sequence
 from torch.utils.data import (
     DataLoader,
     Dataset,
@@ -16,6 +14,9 @@ from torch.utils.data import (
     WeightedRandomSampler,
 )
 
+from utils.helper import get_worker_kwargs, is_leader_process
+from utils.metrics import AveragePrecision, mean, running_mean
+
 from .dataset import AudiosetDataset
 from .model import Model
 
@@ -83,6 +84,7 @@ class DownstreamExpert(nn.Module):
         """
 
         super(DownstreamExpert, self).__init__()
+        self.padded_features = True
         self.upstream_dim = upstream_dim
         self.datarc = downstream_expert["datarc"]
         self.modelrc = downstream_expert["modelrc"]
@@ -130,9 +132,24 @@ class DownstreamExpert(nn.Module):
         )
         self.objective = nn.BCEWithLogitsLoss()
         self.register_buffer("best_score", torch.zeros(1))
-        # for mAP
-        self.predicts = torch.empty((0, 527))
-        self.targets = torch.empty((0, 527))
+        # mAP accumulators of each split, see _average_precision
+        self.average_precisions = {}
+        # the train records are logged (and reset) every log_step optimizer steps
+        runnerrc = kwargs["runner"]
+        self.train_log_samples = (
+            runnerrc["log_step"]
+            * runnerrc.get("gradient_accumulate_steps", 1)
+            * self.datarc["train_batch_size"]
+        )
+
+    def _average_precision(self, split):
+        if split not in self.average_precisions:
+            dataset = getattr(self, f"{split}_dataset")
+            capacity = len(dataset)
+            if split == "train":
+                capacity = min(capacity, self.train_log_samples)
+            self.average_precisions[split] = AveragePrecision(capacity, dataset.class_num)
+        return self.average_precisions[split]
 
     # Interface
     def get_dataloader(self, split, epoch: int = 0):
@@ -150,7 +167,7 @@ class DownstreamExpert(nn.Module):
             batch_size=self.datarc["train_batch_size"],
             shuffle=(sampler is None),
             sampler=sampler,
-            num_workers=self.datarc["num_workers"],
+            **get_worker_kwargs(self.datarc),
             collate_fn=dataset.collate_fn,
         )
 
@@ -159,7 +176,7 @@ class DownstreamExpert(nn.Module):
             dataset,
             batch_size=self.datarc["eval_batch_size"],
             shuffle=False,
-            num_workers=self.datarc["num_workers"],
+            **get_worker_kwargs(self.datarc),
             collate_fn=dataset.collate_fn,
         )
 
@@ -175,8 +192,9 @@ class DownstreamExpert(nn.Module):
                     when the forward is inside the evaluation loop
 
             features:
-                list of unpadded features [feat1, feat2, ...]
-                each feat is in torch.FloatTensor and already
+                padded features (batch_size, max_seq_len, feat_dim),
+                zero past each feature's length given by features_len
+                (see padded_features), in torch.FloatTensor and already
                 put in the device assigned by command-line args
 
             your_other_contents1, ... :
@@ -201,21 +219,18 @@ class DownstreamExpert(nn.Module):
                 the loss to be optimized, should not be detached
                 a single scalar in torch.FloatTensor
         """
-        features = pad_sequence(features, batch_first=True)
         features = self.connector(features)
         predicted = self.model(features)
 
-        utterance_labels = labels
-
-        labels = torch.LongTensor(utterance_labels).to(
-            features.device
-        )  # accum_step*class_num
+        # multi-hot uint8 rows from the dataset, batch_size*class_num
+        labels = torch.stack(labels).to(features.device)
         predicted = predicted.float()
         labels = labels.float()
         loss = self.objective(predicted, labels)
-        records["loss"].append(loss.item())
-        self.predicts = torch.cat((self.predicts.to("cuda"), predicted.to("cuda")), 0)
-        self.targets = torch.cat((self.targets.to("cuda"), labels.to("cuda")), 0)
+        running_mean(records, "loss").update(loss)
+        # only the leader process logs the train records
+        if split != "train" or is_leader_process():
+            self._average_precision(split).update(predicted, labels)
 
         return loss
 
@@ -257,16 +272,13 @@ class DownstreamExpert(nn.Module):
                 according to the evaluation result, like the best.ckpt on the dev set
                 You can return nothing or an empty list when no need to save the checkpoint
         """
-        mAP = average_precision_score(
-            self.targets.cpu().detach().numpy(),
-            self.predicts.cpu().detach().numpy(),
-            average="macro",
-        )
-        records["mAP"].append(mAP)
+        average_precision = self._average_precision(split)
+        records["mAP"].append(average_precision.compute())
+        average_precision.reset()
         print()
         save_names = []
         for key, values in records.items():
-            average = torch.FloatTensor(values).mean().item()
+            average = mean(values)
             logger.add_scalar(
                 f"audioset/{split}-{key}", average, global_step=global_step
             )
@@ -274,6 +286,4 @@ class DownstreamExpert(nn.Module):
             if split == "dev" and key == "mAP" and average > self.best_score:
                 self.best_score = torch.ones(1) * average
                 save_names.append(f"{split}-best.ckpt")
-        self.predicts = torch.empty((0, 527))
-        self.targets = torch.empty((0, 527))
         return save_names
@@ -13,6 +13,8 @@ from torch.distributed import is_initialized
 from torch.nn.utils.rnn import pad_sequence
 from torch.utils.data import DataLoader, Dataset, DistributedSampler
 
+from utils.helper import get_worker_kwargs
+
 from .dataset import RandomDataset
 from .fairseq_dictionary import Dictionary
 from .model import Model
@@ -94,6 +96,7 @@ class DownstreamExpert(nn.Module):
         """
 
         super(DownstreamExpert, self).__init__()
+        self.padded_features = True
         self.seq_task = True
         self.upstream_dim = upstream_dim
         self.datarc = downstream_expert["datarc"]  # config for dataset
@@ -174,7 +177,7 @@ class DownstreamExpert(nn.Module):
             batch_size=self.datarc["train_batch_size"],
             shuffle=(sampler is None),
             sampler=sampler,
-            num_workers=self.datarc["num_workers"],
+            **get_worker_kwargs(self.datarc),
             collate_fn=dataset.collate_fn,
         )
 
@@ -183,7 +186,7 @@ class DownstreamExpert(nn.Module):
             dataset,
             batch_size=self.datarc["eval_batch_size"],
             shuffle=False,
-            num_workers=self.datarc["num_workers"],
+            **get_worker_kwargs(self.datarc),
             collate_fn=dataset.collate_fn,
         )
 
@@ -235,8 +238,12 @@ class DownstreamExpert(nn.Module):
             pred_words_batch.append(pred_words)
         return pred_tokens_batch, pred_words_batch
 
-    def _get_log_probs(self, features):
-        features, features_len = self._get_lens_and_pad(features)
+    def _get_log_probs(self, features, features_len=None):
+        if features_len is None:
+            features, features_len = self._get_lens_and_pad(features)
+        else:
+            # pack_padded_sequence takes the lengths on cpu
+            features_len = features_len.cpu()
         features = self.connector(features)
         logits, log_probs_len = self.model(features, features_len)
         log_probs = nn.functional.log_softmax(logits, dim=-1)
@@ -250,7 +257,7 @@ class DownstreamExpert(nn.Module):
         return all_seqs, seq_lens
 
     # Interface
-    def forward(self, split, features, labels, basenames, records, **kwargs):
+    def forward(self, split, features, labels, basenames, records, features_len=None, **kwargs):
         """
         Args:
             split: string
@@ -261,8 +268,9 @@ class DownstreamExpert(nn.Module):
                     when the forward is inside the evaluation loop
 
             features:
-                list of unpadded features [feat1, feat2, ...]
-                each feat is in torch.FloatTensor and already
+                padded features (batch_size, max_seq_len, feat_dim),
+                zero past each feature's length given by features_len
+                (see padded_features), in torch.FloatTensor and already
                 put in the device assigned by command-line args
 
             your_other_contents1, ... :
@@ -296,7 +304,7 @@ class DownstreamExpert(nn.Module):
             # unpadded_features = []
             # for i in range(len(features)):
             #     unpadded_features.append(features[i][: lens[i]])
-            log_probs, log_probs_len = self._get_log_probs(unpadded_features)
+            log_probs, log_probs_len = self._get_log_probs(unpadded_features, features_len)
         except:
             print("Failed to pad features of shape", features.shape)
 
@@ -5,6 +5,10 @@ import torchaudio
 import torchvision.io
 from torch.utils.data import Dataset
 import torch
+
+from utils.preprocess import RawInput
+
+
 class IEMOCAPDataset(Dataset):
     def __init__(self, iemocap_root, meta_path, preprocess=None, preprocess_audio=None, preprocess_video=None, **kwargs):
         
@@ -18,6 +22,8 @@ class IEMOCAPDataset(Dataset):
         
         self.preprocess = preprocess
         self.preprocess_audio = preprocess_audio
+        # preprocessed features are not cached for --batched_preprocess, whose samples are raw clips
+        self.feature_cache = not isinstance(preprocess_audio, RawInput)
         self.preprocess_video = preprocess_video
         self.upstream_name = kwargs['upstream']
         self.upstream_feature_selection = kwargs['upstream_feature_selection']
@@ -38,7 +44,7 @@ class IEMOCAPDataset(Dataset):
 
         feature_path = f"{self.iemocap_root}/preprocess_features/{self.upstream_name}/{fname.split('/')[0]}/{fname.split('/')[-2]}/{basename}.pt"
         
-        if os.path.exists(feature_path):
+        if self.feature_cache and os.path.exists(feature_path):
             processed_wav, processed_frames = torch.load(feature_path)
         else:
             wav, audio_sr = torchaudio.load(path_join(self.iemocap_root, self.meta_data[idx]['path']))
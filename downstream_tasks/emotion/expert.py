@@ -10,9 +10,11 @@ from pathlib import Path
 import torch
 import torch.nn as nn
 from torch.distributed import is_initialized
-from torch.nn.utils.rnn import pad_sequence
 from torch.utils.data import DataLoader, DistributedSampler, random_split
 
+from utils.helper import get_worker_kwargs
+from utils.metrics import confusion_matrix, mean, running_mean
+
 from .dataset import IEMOCAPDataset, collate_fn
 from .model import *
 
@@ -52,6 +54,7 @@ class DownstreamExpert(nn.Module):
         """
 
         super(DownstreamExpert, self).__init__()
+        self.padded_features = True
         self.upstream_dim = upstream_dim
         self.datarc = downstream_expert["datarc"]  # config for dataset
         self.modelrc = downstream_expert["modelrc"]  # config for model
@@ -112,7 +115,7 @@ class DownstreamExpert(nn.Module):
             batch_size=self.datarc["train_batch_size"],
             shuffle=(sampler is None),
             sampler=sampler,
-            num_workers=self.datarc["num_workers"],
+            **get_worker_kwargs(self.datarc),
             collate_fn=collate_fn,
         )
 
@@ -121,7 +124,7 @@ class DownstreamExpert(nn.Module):
             dataset,
             batch_size=self.datarc["eval_batch_size"],
             shuffle=False,
-            num_workers=self.datarc["num_workers"],
+            **get_worker_kwargs(self.datarc),
             collate_fn=collate_fn,
         )
 
@@ -135,8 +138,9 @@ class DownstreamExpert(nn.Module):
                 'dev', 'test' or more
                     when the forward is inside the evaluation loop
             features:
-                list of unpadded features [feat1, feat2, ...]
-                each feat is in torch.FloatTensor and already
+                padded features (batch_size, max_seq_len, feat_dim),
+                zero past each feature's length given by features_len
+                (see padded_features), in torch.FloatTensor and already
                 put in the device assigned by command-line args
             your_other_contents1, ... :
                 in the order defined by your dataloader (dataset + collate_fn)
@@ -157,7 +161,6 @@ class DownstreamExpert(nn.Module):
                 a single scalar in torch.FloatTensor
         """
         
-        features = pad_sequence(features, batch_first=True)
         features = self.connector(features)
         predicted = self.model(features)
 
@@ -167,11 +170,12 @@ class DownstreamExpert(nn.Module):
 
         predicted_classid = predicted.max(dim=-1).indices
 
-        records["loss"].append(loss.item())
-        records["acc"] += (predicted_classid == labels).view(-1).cpu().float().tolist()
+        running_mean(records, "loss").update(loss)
+        confusion_matrix(records, "acc", predicted.size(-1)).update(predicted_classid, labels)
         records["filename"] += filenames
-        records["predict"] += [self.test_dataset.idx2emotion[idx] for idx in predicted_classid.cpu().tolist()]
-        records["truth"] += [self.test_dataset.idx2emotion[idx] for idx in labels.cpu().tolist()]
+        # class ids stay on the device until log_records writes them out
+        records["predict"].append(predicted_classid)
+        records["truth"].append(labels)
 
         return loss
 
@@ -206,8 +210,7 @@ class DownstreamExpert(nn.Module):
         """
         save_names = []
         for key in ["acc", "loss"]:
-            values = records[key]
-            average = torch.FloatTensor(values).mean().item()
+            average = mean(records[key])
             logger.add_scalar(
                 f'emotion-{self.fold}/{split}-{key}',
                 average,
@@ -223,12 +226,14 @@ class DownstreamExpert(nn.Module):
                         save_names.append(f"{split}-best.ckpt")
                         
         if split in ["dev", "test"]:
+            predict = [self.test_dataset.idx2emotion[idx] for idx in torch.cat(records["predict"]).tolist()]
+            truth = [self.test_dataset.idx2emotion[idx] for idx in torch.cat(records["truth"]).tolist()]
             with open(Path(self.expdir) / f"{split}_{self.fold}_predict.txt", "w") as file:
-                line = [f"{f} {e}\n" for f, e in zip(records["filename"], records["predict"])]
+                line = [f"{f} {e}\n" for f, e in zip(records["filename"], predict)]
                 file.writelines(line)
 
             with open(Path(self.expdir) / f"{split}_{self.fold}_truth.txt", "w") as file:
-                line = [f"{f} {e}\n" for f, e in zip(records["filename"], records["truth"])]
+                line = [f"{f} {e}\n" for f, e in zip(records["filename"], truth)]
                 file.writelines(line)
 
         return save_names
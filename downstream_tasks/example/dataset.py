@@ -9,6 +9,8 @@ import torch
 import torch.nn as nn
 from torch.utils.data.dataset import Dataset
 
+from utils.preprocess import RawInput
+
 # Example parameters
 AUDIO_SAMPLE_RATE = 44100
 VIDEO_FRAME_RATE = 30
@@ -41,6 +43,8 @@ class RandomDataset(Dataset):
         self.video_frame_rates = [VIDEO_FRAME_RATE] * len(self)
         self.preprocess = preprocess
         self.preprocess_audio = preprocess_audio
+        # preprocessed features are not cached for --batched_preprocess, whose samples are raw clips
+        self.feature_cache = not isinstance(preprocess_audio, RawInput)
         self.preprocess_video = preprocess_video
 
         self.upstream_name = kwargs['upstream']
@@ -80,7 +84,7 @@ class RandomDataset(Dataset):
                 return pooled_feature, pooled_feature, label, True
 
         feature_path = f"/work/b07901163/features/{self.upstream_name}/{basename}.pt"
-        if os.path.exists(feature_path):
+        if self.feature_cache and os.path.exists(feature_path):
             processed_wav, processed_frames = torch.load(feature_path)
         else:
             if self.preprocess is not None:
@@ -9,9 +9,11 @@ import random
 import torch
 import torch.nn as nn
 from torch.distributed import is_initialized
-from torch.nn.utils.rnn import pad_sequence
 from torch.utils.data import DataLoader, Dataset, DistributedSampler
 
+from utils.helper import get_worker_kwargs
+from utils.metrics import mean, running_mean
+
 from .dataset import RandomDataset
 from .model import Model
 
@@ -92,6 +94,8 @@ class DownstreamExpert(nn.Module):
         """
 
         super(DownstreamExpert, self).__init__()
+        # the runner passes padded features and features_len, not a list
+        self.padded_features = True
         self.upstream_dim = upstream_dim
         self.datarc = downstream_expert["datarc"]  # config for dataset
         self.modelrc = downstream_expert["modelrc"]  # config for model
@@ -163,7 +167,7 @@ class DownstreamExpert(nn.Module):
             batch_size=self.datarc["train_batch_size"],
             shuffle=(sampler is None),
             sampler=sampler,
-            num_workers=self.datarc["num_workers"],
+            **get_worker_kwargs(self.datarc),
             collate_fn=dataset.collate_fn,
         )
 
@@ -172,7 +176,7 @@ class DownstreamExpert(nn.Module):
             dataset,
             batch_size=self.datarc["eval_batch_size"],
             shuffle=False,
-            num_workers=self.datarc["num_workers"],
+            **get_worker_kwargs(self.datarc),
             collate_fn=dataset.collate_fn,
         )
 
@@ -188,8 +192,9 @@ class DownstreamExpert(nn.Module):
                     when the forward is inside the evaluation loop
 
             features:
-                list of unpadded features [feat1, feat2, ...]
-                each feat is in torch.FloatTensor and already
+                padded features (batch_size, max_seq_len, feat_dim),
+                zero past each feature's length given by features_len
+                (see padded_features), in torch.FloatTensor and already
                 put in the device assigned by command-line args
 
             your_other_contents1, ... :
@@ -214,7 +219,6 @@ class DownstreamExpert(nn.Module):
                 the loss to be optimized, should not be detached
                 a single scalar in torch.FloatTensor
         """
-        features = pad_sequence(features, batch_first=True)
         features = self.connector(features)
         predicted = self.model(features)
 
@@ -224,8 +228,8 @@ class DownstreamExpert(nn.Module):
 
         predicted_classid = predicted.max(dim=-1).indices
 
-        records["loss"].append(loss.item())
-        records["acc"] += (predicted_classid == labels).view(-1).cpu().float().tolist()
+        running_mean(records, "loss").update(loss)
+        running_mean(records, "acc").update(predicted_classid == labels)
 
         return loss
 
@@ -269,7 +273,7 @@ class DownstreamExpert(nn.Module):
         """
         save_names = []
         for key, values in records.items():
-            average = torch.FloatTensor(values).mean().item()
+            average = mean(values)
             logger.add_scalar(
                 f"example/{split}-{key}", average, global_step=global_step
             )
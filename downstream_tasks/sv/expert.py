@@ -7,9 +7,11 @@ import numpy as np
 import torch
 import torch.nn as nn
 from torch.distributed import is_initialized
-from torch.nn.utils.rnn import pad_sequence
 from torch.utils.data import DataLoader, Dataset, DistributedSampler
 
+from utils.helper import get_worker_kwargs
+from utils.metrics import mean, running_mean
+
 from .dataset import Verification_Dataset, Classification_Dataset
 # from .model import Model
 from .model import AMSoftmaxLoss, AAMSoftmaxLoss, SoftmaxLoss, UtteranceExtractor
@@ -91,6 +93,7 @@ class DownstreamExpert(nn.Module):
         """
 
         super(DownstreamExpert, self).__init__()
+        self.padded_features = True
 
         # config
         self.upstream_dim = upstream_dim
@@ -208,7 +211,7 @@ class DownstreamExpert(nn.Module):
             batch_size=self.datarc["train_batch_size"],
             shuffle=None,
             sampler=sampler,
-            num_workers=self.datarc["num_workers"],
+            **get_worker_kwargs(self.datarc),
             collate_fn=dataset.collate_fn,
         )
 
@@ -217,7 +220,7 @@ class DownstreamExpert(nn.Module):
             dataset,
             batch_size=self.datarc["eval_batch_size"],
             shuffle=False,
-            num_workers=self.datarc["num_workers"],
+            **get_worker_kwargs(self.datarc),
             collate_fn=dataset.collate_fn,
         )
 
@@ -233,8 +236,9 @@ class DownstreamExpert(nn.Module):
                     when the forward is inside the evaluation loop
 
             features:
-                list of unpadded features [feat1, feat2, ...]
-                each feat is in torch.FloatTensor and already
+                padded features (batch_size, max_seq_len, feat_dim),
+                zero past each feature's length given by features_len
+                (see padded_features), in torch.FloatTensor and already
                 put in the device assigned by command-line args
 
             others:
@@ -265,7 +269,7 @@ class DownstreamExpert(nn.Module):
                 a single scalar in torch.FloatTensor
         """
                 
-        features_pad = pad_sequence(features, batch_first=True)
+        features_pad = features
         # attention_mask = [torch.ones((feature.shape[0])) for feature in features]
 
         # attention_mask_pad = pad_sequence(attention_mask, batch_first=True)
@@ -281,10 +285,8 @@ class DownstreamExpert(nn.Module):
             loss, predicted = self.objective(agg_vec, labels)
             predicted_classid = predicted.max(dim=-1).indices
             
-            records["loss"].append(loss.item())
-            records["acc"] += (
-                (predicted_classid == labels).view(-1).cpu().float().tolist()
-            )
+            running_mean(records, "loss").update(loss)
+            running_mean(records, "acc").update(predicted_classid == labels)
 
             return loss
             
@@ -338,12 +340,12 @@ class DownstreamExpert(nn.Module):
         save_names = []
 
         if split == "train":
-            loss = torch.FloatTensor(records["loss"]).mean().item()
+            loss = mean(records["loss"])
             logger.add_scalar(f"voxceleb2/{split}-loss", loss, global_step=global_step)
 
         elif split == "dev":
             for key, values in records.items():
-                average = torch.FloatTensor(values).mean().item()
+                average = mean(values)
                 logger.add_scalar(
                     f"voxceleb2/{split}-{key}", average, global_step=global_step
                 )
@@ -11,6 +11,8 @@ import torchvision.transforms as transforms
 from torch.utils.data.dataset import Dataset
 from torchaudio.transforms import Resample
 
+from utils.preprocess import RawInput
+
 
 class VggsoundDataset(Dataset):
     def __init__(
@@ -42,6 +44,8 @@ class VggsoundDataset(Dataset):
 
 
         self.preprocess, self.preprocess_audio, self.preprocess_video = preprocess, preprocess_audio, preprocess_video
+        # preprocessed features are not cached for --batched_preprocess, whose samples are raw clips
+        self.feature_cache = not isinstance(preprocess_audio, RawInput)
 
         self.upstream_name = kwargs['upstream']
         self.upstream_feature_selection = kwargs['upstream_feature_selection']
@@ -74,14 +78,12 @@ class VggsoundDataset(Dataset):
 
         feature_path = f"{self.feature_root}/{self.upstream_name}/{basename}.pt"
 
-        if os.path.exists(feature_path):
+        if self.feature_cache and os.path.exists(feature_path):
             processed_wav, processed_frames = torch.load(feature_path)
         else:
+            # frames stay uint8, the upstream's preprocessing converts them
             frames, wav, meta = torchvision.io.read_video(filepath, pts_unit="sec", output_format="TCHW")
 
-            if "mavil" not in self.upstream_name:
-                frames = frames.float()
-            
             wav = wav.mean(dim=0).squeeze(0)
 
             audio_fps, video_fps = meta["audio_fps"], meta["video_fps"]
@@ -97,7 +99,7 @@ class VggsoundDataset(Dataset):
                     processed_frames = self.preprocess_video(frames, video_fps)
                 else:
                     processed_frames = frames
-            if self.save_features:
+            if self.save_features and self.feature_cache:
                 torch.save([processed_wav, processed_frames], feature_path)
 
         return processed_wav, processed_frames, label, basename
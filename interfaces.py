@@ -4,8 +4,10 @@
 # Modified from S3PRL
 # (Authors: Leo Yang, Andy T. Liu and S3PRL team, https://github.com/s3prl/s3prl/blob/main/s3prl/upstream/interfaces.py)
 
+import pickle
 import random
 import sys
+import types
 from typing import Callable, Dict, List, Tuple, Union
 
 import numpy as np
@@ -37,6 +39,63 @@ class Hook:
         assert isinstance(self.unique_identifier, str)
 
 
+class _EarlyExit(Exception):
+    """
+    Raised by a hook handler once every requested hidden state is collected,
+    so the rest of the upstream forward is skipped
+    """
+
+
+class UpstreamPreprocessor:
+    """
+    Picklable stand-in for an upstream's preprocess / preprocess_audio / preprocess_video,
+    handed to the datasets instead of the upstream's bound methods so that DataLoader
+    workers do not receive the upstream weights.
+
+    It holds a copy of the upstream's plain attributes (configs, rates, small transforms),
+    without its submodules, parameters, buffers and hooks, and runs the upstream class'
+    methods on it. Preprocessing may thus only rely on plain attributes.
+    """
+
+    EXCLUDED_ATTRIBUTES = ("training", "hooks", "hook_postprocess")
+
+    def __init__(self, upstream: nn.Module):
+        self.upstream_class = type(upstream)
+        for key, value in vars(upstream).items():
+            if key.startswith("_") or key in self.EXCLUDED_ATTRIBUTES or isinstance(value, nn.Module):
+                continue
+            try:
+                pickle.dumps(value)
+            except Exception:
+                # e.g. lambdas, which preprocessing does not use
+                continue
+            setattr(self, key, value)
+
+    def __getattr__(self, name):
+        # only called for names missing from the instance: the upstream's methods
+        upstream_class = self.__dict__.get("upstream_class")
+        if upstream_class is None or name.startswith("__"):
+            raise AttributeError(name)
+        method = getattr(upstream_class, name, None)
+        if not callable(method):
+            raise AttributeError(name)
+        return types.MethodType(method, self)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.upstream_class.__name__})"
+
+
+def get_preprocessor(upstream: nn.Module):
+    """
+    The upstream's own preprocessor when it defines get_preprocessor,
+    an UpstreamPreprocessor otherwise
+    """
+    upstream = getattr(upstream, "module", upstream)  # DDP
+    if hasattr(upstream, "get_preprocessor"):
+        return upstream.get_preprocessor()
+    return UpstreamPreprocessor(upstream)
+
+
 class initHook(type):
     def __call__(cls, *args, **kwargs):
         instance = super().__call__(*args, **kwargs)
@@ -63,6 +122,21 @@ class UpstreamBase(nn.Module, metaclass=initHook):
         self.hooks: List[Hook] = [Hook(*hook) for hook in hooks] if hooks else []
         self.hook_postprocess = hook_postprocess
         self._hook_hiddens: List[Tuple(str, Tensor)] = []
+        self._hook_key: str = None
+        self._hook_layers: List[int] = None
+        self._hook_layer_ids: List[int] = []
+
+    def set_output_layers(self, feature_selection: str, layers: List[int] = None):
+        """
+        Only compute the hidden states listed in `layers` for `feature_selection`.
+        When it is the key produced by the hooks, the forward is stopped right after
+        the deepest requested hook fires and the other hidden states are returned as None.
+        Call with layers=None to restore the full forward.
+        """
+        if layers is not None and feature_selection == self._hook_key:
+            self._hook_layers = sorted(set(layers))
+        else:
+            self._hook_layers = None
 
     def remove_all_hooks(self):
         for hook in self.hooks:
@@ -99,9 +173,21 @@ class UpstreamBase(nn.Module, metaclass=initHook):
             )
             hook.handler.remove()
 
+        upstream = self
+
         def generate_hook_handler(hiddens: List, hook: Hook):
             def hook_handler(self, input, output):
-                hiddens.append((hook.unique_identifier, hook.transform(input, output)))
+                layers = upstream._hook_layers
+                if layers is None:
+                    hiddens.append((hook.unique_identifier, hook.transform(input, output)))
+                    return
+
+                layer_id = upstream.hooks.index(hook)
+                if layer_id in layers:
+                    hiddens.append((hook.unique_identifier, hook.transform(input, output)))
+                    upstream._hook_layer_ids.append(layer_id)
+                if layer_id >= layers[-1]:
+                    raise _EarlyExit
 
             return hook_handler
 
@@ -111,13 +197,19 @@ class UpstreamBase(nn.Module, metaclass=initHook):
 
     def __call__(self, wavs: List[Tensor], *args, **kwargs):
         self._hook_hiddens.clear()
+        self._hook_layer_ids.clear()
 
-        result = super().__call__(wavs, *args, **kwargs) or {}
+        try:
+            result = super().__call__(wavs, *args, **kwargs) or {}
+        except _EarlyExit:
+            result = {}
         assert isinstance(result, dict)
 
         if len(self._hook_hiddens) > 0:
             hook_hiddens = self._hook_hiddens.copy()
+            layer_ids = self._hook_layer_ids.copy()
             self._hook_hiddens.clear()
+            self._hook_layer_ids.clear()
 
             if callable(self.hook_postprocess):
                 hook_hiddens = self.hook_postprocess(hook_hiddens)
@@ -129,6 +221,15 @@ class UpstreamBase(nn.Module, metaclass=initHook):
                 key = "video_feats"
             elif "audio" in names[0]:
                 key = "audio_feats"
+            self._hook_key = key
+
+            if self._hook_layers is not None:
+                # keep the layer indices of the full forward, unrequested ones are None
+                full_names = [None] * (self._hook_layers[-1] + 1)
+                full_hiddens = [None] * (self._hook_layers[-1] + 1)
+                for layer_id, name, hidden in zip(layer_ids, names, hiddens):
+                    full_names[layer_id], full_hiddens[layer_id] = name, hidden
+                names, hiddens = tuple(full_names), tuple(full_hiddens)
 
             if (
                 result.get("_hidden_states_info") is not None
@@ -154,8 +255,14 @@ class Featurizer(nn.Module):
         upstream_device: str = "cuda",
         layer_selection: int = None,
         normalize: bool = False,
+        keep_all_outputs: bool = False,
         **kwargs,
     ):
+        """
+        keep_all_outputs: do not let the upstream skip the branches (set_feature_selection)
+            or layers (set_output_layers) the selection does not need, e.g. when every
+            output is saved to --pooled_features_path for later runs
+        """
         super().__init__()
         self.name = "Featurizer"
 
@@ -230,6 +337,29 @@ class Featurizer(nn.Module):
         self.layer_selection = layer_selection
         self.normalize = normalize
 
+        if hasattr(upstream, "set_feature_selection") and not keep_all_outputs:
+            # let the upstream skip the branches the selected feature does not need
+            upstream.set_feature_selection(feature_selection)
+
+        hidden_states = paired_features.get(feature_selection)
+        if isinstance(hidden_states, dict):
+            hidden_states = list(hidden_states.values())
+        if (
+            isinstance(layer_selection, int)
+            and isinstance(hidden_states, (list, tuple))
+            and len(hidden_states) > 1
+            and hasattr(upstream, "set_output_layers")
+            and not keep_all_outputs
+        ):
+            # only the selected layer is needed, let the upstream stop early
+            layer_id = layer_selection % len(hidden_states)
+            upstream.set_output_layers(feature_selection, [layer_id])
+            self.layer_selection = layer_id
+            show(
+                f"[{self.name}] - Only layer {layer_id} of {feature_selection} is computed by the upstream.",
+                file=sys.stderr,
+            )
+
         feature = self._select_feature(paired_features)
         if isinstance(feature, (list, tuple)):
             self.layer_num = len(feature)
@@ -329,14 +459,38 @@ class Featurizer(nn.Module):
             feature = [f for f in paired_feature]
         return feature
 
+    def topadded(self, paired_feature: Tensor, lens=None):
+        """
+        The padded counterpart of tolist: returns paired_feature, as pad_sequence(tolist(...))
+        would, and its (batch_size,) LongTensor of lengths on the same device
+        """
+        assert paired_feature.dim() == 3, "(batch_size, max_seq_len, feat_dim)"
+        batch_size, max_seq_len = paired_feature.shape[:2]
+        if lens is None:
+            lengths = torch.full((batch_size,), max_seq_len, dtype=torch.long, device=paired_feature.device)
+            return paired_feature, lengths
+
+        assert len(lens) == len(paired_feature)
+        lengths = torch.as_tensor(lens, dtype=torch.long).to(paired_feature.device)
+        paired_feature = paired_feature[:, : max(lens)]
+        mask = torch.arange(paired_feature.size(1), device=paired_feature.device) < lengths.unsqueeze(1)
+        return paired_feature * mask.unsqueeze(-1).to(paired_feature.dtype), lengths
+
     def forward(
         self,
         paired_wavs: List[Tuple[Tensor, Tensor]],
         paired_features: Dict[str, Union[Tensor, List[Tensor], Dict[str, Tensor]]],
         lens=None, 
+        padded: bool = False,
     ):
+        """
+        Returns the list of unpadded features, or with padded=True the padded
+        (batch_size, max_seq_len, feat_dim) features and their lengths
+        """
         feature = self._select_feature(paired_features)
         if isinstance(feature, (list, tuple)):
             feature = self._weighted_sum(feature)
 
+        if padded:
+            return self.topadded(feature, lens)
         return self.tolist(paired_wavs, feature, lens)
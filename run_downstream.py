@@ -167,6 +167,11 @@ def get_downstream_args():
     )
     parser.add_argument("--verbose", action="store_true", help="Print model infomation")
     parser.add_argument("--disable_cudnn", action="store_true", help="Disable CUDNN")
+    parser.add_argument(
+        "--batched_preprocess",
+        action="store_true",
+        help="DataLoader workers only decode, the upstream preprocessing runs on --device for whole batches",
+    )
     # Path to where to save the features
     parser.add_argument('--pooled_features_path', type=str)
     parser.add_argument("--log_file", default="result.log", type=str, help="Path to save the log file (reletive to expdir)")
@@ -26,9 +26,18 @@ from torch.nn.utils.rnn import pad_sequence
 from tqdm import tqdm
 
 import hub
-from interfaces import Featurizer
+from interfaces import (
+    AUDIO_SAMPLE_RATE,
+    HEIGHT,
+    MIN_SEC,
+    VIDEO_SAMPLE_RATE,
+    WIDTH,
+    Featurizer,
+    get_preprocessor,
+)
 from utils.helper import defaultdict, get_model_state, is_leader_process, show
 from utils.optimizers import get_optimizer
+from utils.preprocess import RawInput, batch_preprocess
 from utils.schedulers import get_scheduler
 from utils.file_logger import FileWriter
 
@@ -60,10 +69,36 @@ class Runner:
 
         self.upstream = self._get_upstream()
         self.featurizer = self._get_featurizer()
-        self.downstream = self._get_downstream(
-            self.upstream.model.preprocess if hasattr(self.upstream.model, "preprocess") else None ,self.upstream.model.preprocess_audio, self.upstream.model.preprocess_video
-        )
+        # datasets get a picklable copy of the upstream's preprocessing, without its weights
+        self.preprocessor = get_preprocessor(self.upstream.model)
+        self.batched_preprocess = getattr(self.args, "batched_preprocess", False)
+        if self.batched_preprocess and hasattr(self.preprocessor, "preprocess"):
+            show("[Runner] - The upstream preprocesses audio and video jointly, --batched_preprocess is ignored")
+            self.batched_preprocess = False
+        elif self.batched_preprocess and not getattr(self.preprocessor, "device_preprocess", True):
+            show("[Runner] - The upstream preprocessing only runs on the cpu, --batched_preprocess is ignored")
+            self.batched_preprocess = False
+        elif self.batched_preprocess:
+            error = self._check_device_preprocess()
+            if error:
+                show(f"[Runner] - The upstream preprocessing fails on {self.args.device} ({error}), --batched_preprocess is ignored")
+                self.batched_preprocess = False
+
+        if self.batched_preprocess:
+            # datasets only decode, see _get_source
+            self.downstream = self._get_downstream(None, RawInput(), RawInput())
+        else:
+            self.downstream = self._get_downstream(
+                self.preprocessor.preprocess if hasattr(self.preprocessor, "preprocess") else None,
+                self.preprocessor.preprocess_audio,
+                self.preprocessor.preprocess_video,
+            )
+        # experts with padded_features = True take the padded features and their
+        # lengths instead of a list of unpadded features, see _featurize
+        downstream = getattr(self.downstream.model, "module", self.downstream.model)  # DDP
+        self.padded_features = getattr(downstream, "padded_features", False)
         self.all_entries = [self.upstream, self.featurizer, self.downstream]
+        self.dataloaders = {}
 
     def _load_weight(self, model, name):
         init_weight = self.init_ckpt.get(name)
@@ -108,13 +143,19 @@ class Runner:
         if is_initialized() and get_rank() == 0:
             torch.distributed.barrier()
 
-        return self._init_model(
+        entry = self._init_model(
             model=model,
             name="Upstream",
             trainable=self.args.upstream_trainable,
             interfaces=["preprocess_audio", "preprocess_video"],
         )
 
+        if not self.args.upstream_trainable and hasattr(model, "fold_weights"):
+            # frozen upstream: precompute inference-only weights once the weights are loaded
+            model.fold_weights()
+
+        return entry
+
     def _get_featurizer(self):
         model = Featurizer(
             upstream=self.upstream.model,
@@ -122,6 +163,8 @@ class Runner:
             layer_selection=self.args.upstream_layer_selection,
             upstream_device=self.args.device,
             normalize=self.args.upstream_feature_normalize,
+            # the pooled feature cache holds every output of the upstream
+            keep_all_outputs=bool(self.args.pooled_features_path),
         ).to(self.args.device)
 
         return self._init_model(
@@ -154,6 +197,77 @@ class Runner:
             interfaces=["get_dataloader", "log_records"],
         )
 
+    def _get_dataloader(self, split, epoch: int = 0):
+        """
+        The downstream's DataLoader for split, built once and reused across epochs and
+        evaluations so its (persistent) workers are only started once. Each epoch
+        reshuffles through the sampler, DistributedSampler.set_epoch under DDP
+        """
+        dataloader = self.dataloaders.get(split)
+        if dataloader is None:
+            try:
+                dataloader = self.downstream.model.get_dataloader(split, epoch=epoch)
+            except TypeError as e:
+                if "unexpected keyword argument 'epoch'" in str(e):
+                    dataloader = self.downstream.model.get_dataloader(split)
+                else:
+                    raise
+            self.dataloaders[split] = dataloader
+
+        if isinstance(getattr(dataloader, "sampler", None), DistributedSampler):
+            dataloader.sampler.set_epoch(epoch)
+        return dataloader
+
+    def _check_device_preprocess(self):
+        """
+        Runs the batched preprocessing stage on a dummy clip, as the Featurizer does,
+        returns why the upstream's preprocessing does not run on --device, or None
+        """
+        upstream = getattr(self.upstream.model, "module", self.upstream.model)  # DDP
+        wavs = [(torch.randn(MIN_SEC * AUDIO_SAMPLE_RATE), AUDIO_SAMPLE_RATE)]
+        frames = [(torch.ones(MIN_SEC * VIDEO_SAMPLE_RATE, 3, HEIGHT, WIDTH, dtype=torch.uint8), VIDEO_SAMPLE_RATE)]
+        try:
+            source = batch_preprocess(upstream, wavs, frames, self.args.device)
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+
+        device = torch.device(self.args.device)
+        for tensor in source[0]:
+            if tensor.device.type != device.type or (
+                device.index is not None and tensor.device.index != device.index
+            ):
+                return f"its output is on {tensor.device}"
+        return None
+
+    def _get_source(self, wavs, frames):
+        """
+        The upstream input on self.args.device: the batch is preprocessed here in
+        --batched_preprocess mode, it was preprocessed by the DataLoader workers otherwise
+        """
+        if self.batched_preprocess:
+            upstream = getattr(self.upstream.model, "module", self.upstream.model)  # DDP
+            return batch_preprocess(upstream, wavs, frames, self.args.device)
+        # frames keep the dtype the upstream's preprocessing chose (e.g. uint8),
+        # upstreams convert them at the model input
+        return [
+            (
+                wav.float().to(self.args.device),
+                frame.to(self.args.device),
+            )
+            for wav, frame in zip(wavs, frames)
+        ]
+
+    def _featurize(self, source, features, lens=None):
+        """
+        The downstream input: (features, kwargs) to call the downstream expert with,
+        either the list of unpadded features, or the padded (batch_size, max_seq_len, feat_dim)
+        features and kwargs {"features_len": (batch_size,) LongTensor}
+        """
+        if self.padded_features:
+            features, features_len = self.featurizer.model(source, features, lens, padded=True)
+            return features, {"features_len": features_len}
+        return self.featurizer.model(source, features, lens), {}
+
     def _get_optimizer(self, model_params):
         optimizer = get_optimizer(
             model_params, self.config["runner"]["total_steps"], self.config["optimizer"]
@@ -211,24 +325,15 @@ class Runner:
         epoch = self.init_ckpt.get("Epoch", 0)
         train_split = self.config["runner"].get("train_dataloader", "train")
         while pbar.n < pbar.total:
-            try:
-                dataloader = self.downstream.model.get_dataloader(
-                    train_split, epoch=epoch
-                )
-            except TypeError as e:
-                if "unexpected keyword argument 'epoch'" in str(e):
-                    dataloader = self.downstream.model.get_dataloader(train_split)
-                    if hasattr(dataloader, "sampler") and isinstance(
-                        dataloader.sampler, DistributedSampler
-                    ):
-                        dataloader.sampler.set_epoch(epoch)
-                else:
-                    raise
+            new_dataloader = train_split not in self.dataloaders
+            dataloader = self._get_dataloader(train_split, epoch)
 
             gradient_accumulate_steps = self.config["runner"].get(
                 "gradient_accumulate_steps"
             )
-            dataloader.dataset.skip_steps = dataloader.batch_size * gradient_accumulate_steps * init_step % len(dataloader.dataset)
+            if new_dataloader:
+                # persistent workers keep the copy of the dataset they started with
+                dataloader.dataset.skip_steps = dataloader.batch_size * gradient_accumulate_steps * init_step % len(dataloader.dataset)
             
             train_pbar = tqdm(dataloader, dynamic_ncols=True, desc="train", file=tqdm_file)
             for batch_id, (wavs, frames, *others) in enumerate(train_pbar):
@@ -267,13 +372,7 @@ class Runner:
                             else:
                                 features[self.args.upstream_feature_selection] = torch.stack(wavs).to(self.args.device)
                     else:
-                        source = [
-                            (
-                                wav.float().to(self.args.device),
-                                frame.float().to(self.args.device),
-                            )
-                            for wav, frame in zip(wavs, frames)
-                        ]
+                        source = self._get_source(wavs, frames)
                         if self.upstream.trainable:
                             features = self.upstream.model(source)
                         else:
@@ -306,13 +405,14 @@ class Runner:
                                             save_target = feature[i].detach().cpu()
                                         torch.save(save_target, f"{self.args.pooled_features_path}/{self.args.upstream}_{key}/{names_k}_pooled.pt")
 
-                    features = self.featurizer.model(source, features, lens)
+                    features, features_kwargs = self._featurize(source, features, lens)
 
                     loss = self.downstream.model(
                         train_split,
                         features,
                         *others,
                         records=records,
+                        **features_kwargs,
                     )
                     batch_ids.append(batch_id)
 
@@ -457,7 +557,7 @@ class Runner:
             entry.model.eval()
 
         # prepare data
-        dataloader = self.downstream.model.get_dataloader(split)
+        dataloader = self._get_dataloader(split)
         evaluate_ratio = float(self.config["runner"].get("evaluate_ratio", 1))
         evaluate_steps = round(len(dataloader) * evaluate_ratio)
 
@@ -495,13 +595,7 @@ class Runner:
                     else:
                         features[self.args.upstream_feature_selection] = torch.stack(wavs).to(self.args.device)
             else:
-                source = [
-                    (
-                        wav.float().to(self.args.device),
-                        frame.float().to(self.args.device),
-                    )
-                    for wav, frame in zip(wavs, frames)
-                ]
+                source = self._get_source(wavs, frames)
                 with torch.no_grad():
                     features = self.upstream.model(source)
                 if self.args.pooled_features_path:
@@ -534,13 +628,14 @@ class Runner:
 
 
             with torch.no_grad():
-                features = self.featurizer.model(source, features, lens)
+                features, features_kwargs = self._featurize(source, features, lens)
                 self.downstream.model(
                     split,
                     features,
                     *others,
                     records=records,
                     batch_id=batch_id,
+                    **features_kwargs,
                 )
                 batch_ids.append(batch_id)
 
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the repo is not installed, import its modules from the root as run_downstream.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,80 @@
+import warnings
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+sklearn_metrics = pytest.importorskip("sklearn.metrics")
+
+from utils.metrics import AveragePrecision, average_precision
+
+
+def _sample(num_samples=200, num_classes=6, seed=0):
+    rng = np.random.default_rng(seed)
+    # one decimal, so many scores are tied
+    scores = np.round(rng.standard_normal((num_samples, num_classes)), 1)
+    targets = (rng.random((num_samples, num_classes)) < 0.3).astype(np.int64)
+    # a class without positives
+    targets[:, -1] = 0
+    return scores, targets
+
+
+def _sklearn_average_precision(scores, targets):
+    with warnings.catch_warnings():
+        # "No positive class found in y_true"
+        warnings.simplefilter("ignore")
+        return sklearn_metrics.average_precision_score(targets, scores, average=None)
+
+
+def test_average_precision_matches_sklearn():
+    scores, targets = _sample()
+    expected = _sklearn_average_precision(scores, targets)
+    actual = average_precision(torch.from_numpy(scores), torch.from_numpy(targets).bool()).numpy()
+
+    # classes without positives score 0 (older sklearn versions return nan)
+    assert actual[-1] == 0
+    np.testing.assert_allclose(actual[:-1], expected[:-1], atol=1e-6)
+    if not np.isnan(expected[-1]):
+        assert expected[-1] == 0
+
+
+def test_average_precision_all_tied():
+    scores = np.zeros((10, 2))
+    targets = np.array([[1, 0]] * 3 + [[0, 1]] * 7)
+    expected = _sklearn_average_precision(scores, targets)
+    actual = average_precision(torch.from_numpy(scores), torch.from_numpy(targets).bool()).numpy()
+    np.testing.assert_allclose(actual, expected, atol=1e-6)
+
+
+def test_accumulator_grows_and_matches_macro():
+    scores, targets = _sample(num_classes=5)
+    targets = targets[:, :-1]
+    scores = scores[:, :-1]
+    accumulator = AveragePrecision(capacity=16, num_classes=scores.shape[1])
+    for start in range(0, len(scores), 30):
+        accumulator.update(
+            torch.from_numpy(scores[start : start + 30]).float(),
+            torch.from_numpy(targets[start : start + 30]),
+        )
+
+    expected = sklearn_metrics.average_precision_score(targets, scores.astype(np.float32), average="macro")
+    assert accumulator.compute() == pytest.approx(expected, abs=1e-6)
+
+    accumulator.reset()
+    assert np.isnan(accumulator.compute())
+
+
+def test_accumulator_gather_single_process(tmp_path):
+    dist = torch.distributed
+    if not dist.is_available():
+        pytest.skip("torch.distributed is not available")
+    scores, targets = _sample(num_classes=4)
+    scores, targets = scores[:, :-1], targets[:, :-1]
+    accumulator = AveragePrecision(capacity=len(scores), num_classes=scores.shape[1])
+    accumulator.update(torch.from_numpy(scores).float(), torch.from_numpy(targets))
+
+    dist.init_process_group("gloo", init_method=f"file://{tmp_path}/store", rank=0, world_size=1)
+    try:
+        assert accumulator.compute(gather=True) == pytest.approx(accumulator.compute(), abs=1e-7)
+    finally:
+        dist.destroy_process_group()
@@ -0,0 +1,47 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+skimage_feature = pytest.importorskip("skimage.feature")
+
+from upstream_models.hog.feature import hog
+
+
+@pytest.mark.parametrize(
+    "shape, orientations, pixels_per_cell, cells_per_block",
+    [
+        # the hog upstream's config
+        ((3, 64, 80), 8, (16, 16), (1, 1)),
+        # skimage's defaults
+        ((2, 48, 56), 9, (8, 8), (3, 3)),
+        # frame size not divisible by the cell size
+        ((2, 70, 93), 9, (8, 8), (3, 3)),
+        ((2, 70, 93), 8, (16, 16), (1, 1)),
+    ],
+)
+def test_hog_matches_skimage(shape, orientations, pixels_per_cell, cells_per_block):
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 256, size=shape).astype(np.float64)
+
+    expected = np.stack(
+        [
+            skimage_feature.hog(
+                frame,
+                orientations=orientations,
+                pixels_per_cell=pixels_per_cell,
+                cells_per_block=cells_per_block,
+                block_norm="L2-Hys",
+                feature_vector=True,
+            )
+            for frame in frames
+        ]
+    )
+    actual = hog(
+        torch.from_numpy(frames),
+        orientations=orientations,
+        pixels_per_cell=pixels_per_cell,
+        cells_per_block=cells_per_block,
+    ).numpy()
+
+    assert actual.shape == expected.shape
+    np.testing.assert_allclose(actual, expected, atol=1e-6)
@@ -0,0 +1,45 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("cv2")
+
+from upstream_models.vhubert import utils as custom_utils
+
+
+def stacker(feats, stack_order):
+    """The per-clip numpy stacker batch_stacker replaced"""
+    feat_dim = feats.shape[1]
+    if len(feats) % stack_order != 0:
+        res = stack_order - len(feats) % stack_order
+        res = np.zeros([res, feat_dim]).astype(feats.dtype)
+        feats = np.concatenate([feats, res], axis=0)
+    feats = feats.reshape((-1, stack_order, feat_dim)).reshape(-1, stack_order * feat_dim)
+    return feats
+
+
+@pytest.mark.parametrize(
+    "lengths, stack_order",
+    [
+        # the av-hubert config: 16 kHz audio, 4 stacked frames
+        ([16000, 12345, 4000], 4),
+        # number of frames already a multiple of stack_order, and a clip shorter than a window
+        ([16240, 300], 4),
+        ([8000, 7999, 16000], 1),
+    ],
+)
+def test_batch_logfbank_matches_logfbank(lengths, stack_order):
+    rng = np.random.default_rng(0)
+    clips = [rng.uniform(-1, 1, size=length).astype(np.float32) for length in lengths]
+
+    expected = [stacker(custom_utils.logfbank(clip, samplerate=16000).astype(np.float32), stack_order) for clip in clips]
+
+    signals = torch.nn.utils.rnn.pad_sequence([torch.from_numpy(clip) for clip in clips], batch_first=True)
+    feats, feat_lengths = custom_utils.batch_logfbank(signals, torch.LongTensor(lengths), samplerate=16000)
+    feats, feat_lengths = custom_utils.batch_stacker(feats, feat_lengths, stack_order)
+
+    assert feat_lengths.tolist() == [len(feat) for feat in expected]
+    for feat, length, expected_feat in zip(feats, feat_lengths.tolist(), expected):
+        np.testing.assert_allclose(feat[:length].numpy(), expected_feat, rtol=1e-4, atol=1e-3)
+        # zero padding past each clip's length
+        assert not feat[length:].any()
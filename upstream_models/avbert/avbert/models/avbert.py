@@ -157,6 +157,11 @@ class AVBert(nn.Module):
         visual_seq=None,
         audio_seq=None,
     ):
+        """
+        visual_seq may hold several views of each clip folded into the batch
+        dimension (view-major). audio_seq then keeps one entry per clip: the
+        audio branch runs once and is tiled over the views before fusion.
+        """
         batch_size, seqlen = \
             visual_seq[0].size()[:2] if visual_seq is not None else \
             audio_seq.size()[:2]
@@ -185,10 +190,11 @@ class AVBert(nn.Module):
             )
             idx2modality.append('visual')
         if 'audio' in self.cfg.MODEL.ARCH and audio_seq is not None:
+            audio_batch_size = audio_seq.size(0)
             nchannels, frequency, time = audio_seq.size()[2:]
             aconv_repr = self.audio_conv.get_feature_map(
                 audio_seq.view(
-                    batch_size * seqlen,
+                    audio_batch_size * seqlen,
                     nchannels,
                     frequency,
                     time,
@@ -196,7 +202,7 @@ class AVBert(nn.Module):
             )
             conv_outputs.append(aconv_repr)
             _conv_outputs.append(
-                self.audio_conv.get_logit(aconv_repr).view(batch_size, seqlen, -1)
+                self.audio_conv.get_logit(aconv_repr).view(audio_batch_size, seqlen, -1)
             )
             idx2modality.append('audio')
         # assert len({len(_conv_outputs), self.num_modalities}) == 1
@@ -235,18 +241,21 @@ class AVBert(nn.Module):
                 f"single_{idx2modality[idx]}_transformer"
             )
             _idx = self.modality2idx[idx2modality[idx]]
-            if self.cfg.TRANSFORMER.OUTPUT_HIDDEN_STATES:
-                single_hidden = s_transformer(
-                    s_embeddings(single_inputs[idx]),
-                    attention_mask=att_mask,
-                    modality_idx=_idx
-                )[1] # hidden_states
-                single_hiddens.append(single_hidden)
-            single_output = s_transformer(
+            single_batch_size = single_inputs[idx].size(0)
+            # a single pass gives both the last layer and the hidden states
+            s_outputs = s_transformer(
                 s_embeddings(single_inputs[idx]),
-                attention_mask=att_mask,
+                attention_mask=att_mask[:single_batch_size],
                 modality_idx=_idx
-            )[0] # last layer
+            )
+            if self.cfg.TRANSFORMER.OUTPUT_HIDDEN_STATES:
+                single_hiddens.append(s_outputs[1]) # hidden_states
+            single_output = s_outputs[0] # last layer
+            if single_batch_size != batch_size:
+                # share the branch computed once per clip across the views
+                single_output = single_output.repeat(
+                    batch_size // single_batch_size, 1, 1
+                )
             single_outputs.append(single_output)
 
 
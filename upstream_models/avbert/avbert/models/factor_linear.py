@@ -19,6 +19,8 @@ class FactorLinear(nn.Module):
         K="100",
     ):
         super(FactorLinear, self).__init__()
+        self.num_modality_groups = num_modality_groups
+        self.folded = False
         for i in range(num_modality_groups):
             self.add_module(
                 "ms{}_linear".format(i),
@@ -57,9 +59,44 @@ class FactorLinear(nn.Module):
 
         self.s_linear = nn.Linear(orthogonal_size, output_size)
 
+    @torch.no_grad()
+    def fold(self):
+        """
+        Inference-time export: materialise the orthogonal matrix B of every
+        modality group and fold it into s_linear, so the forward becomes
+        ms_linear -> normalize -> one dense layer. The folded weights are
+        non-persistent buffers, the state dict is unchanged.
+        Only use it for a frozen model, the folded weights are not updated.
+        """
+        for i in range(self.num_modality_groups):
+            B = getattr(self, "orthogonal_ms{}_linear".format(i)).B
+            # (x @ B) @ W^T == x @ (W @ B^T)^T
+            self.register_buffer(
+                "folded_ms{}_weight".format(i),
+                self.s_linear.weight.mm(B.t()).detach(),
+                persistent=False,
+            )
+        self.folded = True
+
     def forward(self, x, modality_idx):
         x = getattr(self, "ms{}_linear".format(modality_idx))(x)
         x = F.normalize(x, dim=-1)
+        if self.folded:
+            return F.linear(
+                x,
+                getattr(self, "folded_ms{}_weight".format(modality_idx)),
+                self.s_linear.bias,
+            )
         x = getattr(self, "orthogonal_ms{}_linear".format(modality_idx))(x)
         x = self.s_linear(x)
         return x
+
+
+def fold_factor_linears(model):
+    """
+    Fold every FactorLinear of `model` for inference, see FactorLinear.fold
+    """
+    for module in model.modules():
+        if isinstance(module, FactorLinear):
+            module.fold()
+    return model
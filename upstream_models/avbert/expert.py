@@ -9,10 +9,11 @@ import torchaudio.transforms as aT
 import torchvision
 from torch import Tensor
 from torch.nn.utils.rnn import pad_sequence
-from .preprocess_function import get_audio_seq, get_visual_seq, resample
+from .preprocess_function import get_audio_seq, get_visual_seqs, resample
 from .avbert.utils import checkpoint as cu
 from .avbert.config import get_cfg
 from .avbert.models.avbert import AVBert
+from .avbert.models.factor_linear import fold_factor_linears
 
 
 class UpstreamExpert(nn.Module):
@@ -52,6 +53,13 @@ class UpstreamExpert(nn.Module):
         )
         assert len(missing_keys) == 0 and len(unexpected_keys) == 0
 
+    def fold_weights(self):
+        """
+        Export step for a frozen upstream: fold the orthogonal and output
+        projections of every FactorLinear into one dense matrix per modality
+        """
+        fold_factor_linears(self.multi_encoder)
+
     def preprocess_video(self, video, video_frame_rate):
         """
         Replace this function to preprocess videos into your input format
@@ -72,8 +80,6 @@ class UpstreamExpert(nn.Module):
         
         video = video.permute(0, 2, 3 ,1)
 
-        visual_seqs = []
-
         num_frames = (
             self.cfg.DATA.NUM_FRAMES *
             self.cfg.DATA.SAMPLING_RATE *
@@ -89,23 +95,20 @@ class UpstreamExpert(nn.Module):
         )
 
         visual_delta = max(video.size(0) - num_frames, 0)
-        for spatial_sample_index in range(self.cfg.TEST.NUM_SPATIAL_CROPS):
-            visual_start_idx = [
-                visual_delta * temporal_sample_index / (self.cfg.TEST.NUM_ENSEMBLE_VIEWS - 1)
-                for temporal_sample_index in range(self.cfg.TEST.NUM_ENSEMBLE_VIEWS)
-            ]
-            visual_end_idx = [s + num_frames - 1 for s in visual_start_idx]
-            visual_seq = get_visual_seq(
-                video,
-                visual_start_idx,
-                visual_end_idx,
-                self.cfg.DATA.NUM_FRAMES,
-                self.cfg.DATA.TEST_CROP_SIZE,
-                spatial_sample_index,
-            )
-            visual_seqs.append(visual_seq)
-
-        visual_seqs = torch.stack(visual_seqs)
+        visual_start_idx = [
+            visual_delta * temporal_sample_index / (self.cfg.TEST.NUM_ENSEMBLE_VIEWS - 1)
+            for temporal_sample_index in range(self.cfg.TEST.NUM_ENSEMBLE_VIEWS)
+        ]
+        visual_end_idx = [s + num_frames - 1 for s in visual_start_idx]
+        # The spatial crops share the sampled and resized clips
+        visual_seqs = get_visual_seqs(
+            video,
+            visual_start_idx,
+            visual_end_idx,
+            self.cfg.DATA.NUM_FRAMES,
+            self.cfg.DATA.TEST_CROP_SIZE,
+            list(range(self.cfg.TEST.NUM_SPATIAL_CROPS)),
+        )
 
         if len(audio.shape) == 1:
             waveform = audio.unsqueeze(0)
@@ -157,34 +160,29 @@ class UpstreamExpert(nn.Module):
         audios = pad_sequence(audio, batch_first=True)
         videos = torch.stack(video)
 
-        videos = videos.transpose(0, 1).contiguous()
+        # Fold the spatial views into the batch (view-major), the audio branch
+        # is computed once per clip and shared across the views
+        num_views = videos.size(1)
+        videos = videos.transpose(0, 1).flatten(0, 1)
 
-        _ , single_hiddens_0, multi_hidden_0 = self.multi_encoder(
-            visual_seq=[videos[0]], audio_seq=audios
-        )
-
-        _ , single_hiddens_1, multi_hidden_1 = self.multi_encoder(
-            visual_seq=[videos[1]], audio_seq=audios
-        )
-
-        _ , single_hiddens_2, multi_hidden_2 = self.multi_encoder(
-            visual_seq=[videos[2]], audio_seq=audios
+        _ , single_hiddens, multi_hidden = self.multi_encoder(
+            visual_seq=[videos], audio_seq=audios
         )
 
         # Concat features of three views along time axis (B x 3L x 768) or along hidden dim axis (B x L x 3*768)
-        audio_feats = single_hiddens_0[1]
+        audio_feats = single_hiddens[1]
         if self.feature_concat_axis == 'time':
-            video_feats = []
-            for layer_0, layer_1, layer_2 in zip(single_hiddens_0[0], single_hiddens_1[0], single_hiddens_2[0]):
-                stacked = torch.stack((layer_0, layer_1, layer_2), dim = 2)
-                video_feats.append(torch.flatten(stacked, start_dim=1, end_dim=2))
-            fusion_feats = []
-            for layer_0, layer_1, layer_2 in zip(multi_hidden_0, multi_hidden_1, multi_hidden_2):
-                stacked = torch.stack((layer_0, layer_1, layer_2), dim = 2)
-                fusion_feats.append(torch.flatten(stacked, start_dim=1, end_dim=2))
+            video_feats = [
+                torch.stack(layer.chunk(num_views), dim=2).flatten(1, 2)
+                for layer in single_hiddens[0]
+            ]
+            fusion_feats = [
+                torch.stack(layer.chunk(num_views), dim=2).flatten(1, 2)
+                for layer in multi_hidden
+            ]
         elif self.feature_concat_axis == 'hidden':
-            video_feats = tuple(torch.cat((layer_0, layer_1, layer_2), dim = 2) for layer_0, layer_1, layer_2 in zip(single_hiddens_0[0], single_hiddens_1[0], single_hiddens_2[0]))
-            fusion_feats = tuple(torch.cat((layer_0, layer_1, layer_2), dim = 2) for layer_0, layer_1, layer_2 in zip(multi_hidden_0, multi_hidden_1, multi_hidden_2))
+            video_feats = tuple(torch.cat(layer.chunk(num_views), dim=2) for layer in single_hiddens[0])
+            fusion_feats = tuple(torch.cat(layer.chunk(num_views), dim=2) for layer in multi_hidden)
         else:
             raise NotImplementedError
 
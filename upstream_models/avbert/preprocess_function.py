@@ -2,6 +2,79 @@ import torch
 import torchaudio
 import math
 import numpy as np
+from functools import lru_cache
+
+from utils import audio_ops
+
+VISUAL_MEAN = 0.45
+VISUAL_STD = 0.225
+
+
+@lru_cache(maxsize=None)
+def get_mel_spectrogram(sample_rate, n_fft, n_mels):
+    """
+    Memoised mel spectrogram transform, the window and mel filterbank are
+    only built once per (sample_rate, n_fft, n_mels) in each process.
+    """
+    return torchaudio.transforms.MelSpectrogram(
+        sample_rate, n_fft=n_fft, n_mels=n_mels,
+    )
+
+
+def get_visual_seqs(
+    frames,
+    start_idx,
+    end_idx,
+    video_num_frames,
+    crop_size,
+    spatial_sample_indices,
+):
+    """
+    Same as `get_visual_seq`, for several spatial crops of the same clips.
+    The clips are temporally sampled and resized once, each crop is then a
+    slice of the resized frames, and normalization is a single fused op.
+    args:
+        frames (tensor): a tensor of video frames, dimension is
+            `num frames` x `height` x `width` x `channel`.
+        start_idx (list): list of the index of the start frame of each clip.
+        end_idx (list): list of the index of the end frame of each clip.
+        video_num_frames (int): number of frames sampled in each clip.
+        crop_size (int): the size of height and width used to crop the
+            frames.
+        spatial_sample_indices (list): 0, 1, or 2 for each crop, see
+            `uniform_crop`.
+    returns:
+        clip_seqs (tensor): the sampled frames of every crop. The dimension is
+            `num crops` x `sequence length` x `channel` x `num frames` x `height` x `width`.
+    """
+    # Temporal sampling of every clip in a single gather.
+    index = torch.cat(
+        [torch.linspace(s, e, video_num_frames) for s, e in zip(start_idx, end_idx)]
+    )
+    index = torch.clamp(index, 0, frames.shape[0] - 1).long()
+    clip_seq = torch.index_select(frames, 0, index)
+
+    # SxT H W C -> SxT C H W, still in the original (usually uint8) dtype
+    clip_seq = clip_seq.permute(0, 3, 1, 2)
+    clip_seq = short_side_scale_jitter(clip_seq, crop_size)
+    clip_seqs = torch.stack(
+        [uniform_crop(clip_seq, crop_size, idx) for idx in spatial_sample_indices]
+    )
+
+    # uint8 in [0, 255] -> normalized float
+    clip_seqs = color_normalization(
+        clip_seqs.float(), VISUAL_MEAN * 255.0, VISUAL_STD * 255.0
+    )
+
+    # N SxT C H W -> N S C T H W
+    clip_seqs = clip_seqs.reshape(
+        len(spatial_sample_indices),
+        len(start_idx),
+        video_num_frames,
+        *clip_seqs.shape[2:],
+    )
+    return clip_seqs.transpose(2, 3).contiguous()
+
 
 def get_visual_seq(
     frames,
@@ -31,49 +104,14 @@ def get_visual_seq(
         clip_seq (tensor): a sequence of sampled frames. The dimension is
             `sequence length` x `channel` x `num frames` x `height` x `width`.
     """
-    # Temporal sampling.
-    clip_seq = []
-    for s, e in zip(start_idx, end_idx):
-        clip_seq.append(
-            temporal_sampling(
-                frames,
-                s,
-                e,
-                video_num_frames,
-            )
-        )
-    clip_seq = torch.stack(clip_seq, dim=0)
-
-    # Convert frames of the uint type in the range [0, 255] to
-    # a torch.FloatTensor in the range [0.0, 1.0]
-    clip_seq = clip_seq.float()
-    clip_seq = clip_seq / 255.0
-
-    # S T H W C -> SxT C H W
-    clip_seq = clip_seq.view(
-        clip_seq.shape[0] * clip_seq.shape[1],
-        clip_seq.shape[2],
-        clip_seq.shape[3],
-        clip_seq.shape[4],
-    )
-    clip_seq = clip_seq.permute(0, 3, 1, 2)
-    # Visual transformations.
-    clip_seq = apply_visual_transform(
-        clip_seq,
-        spatial_idx=spatial_sample_index,
-        crop_size=crop_size,
-    )
-    # SxT C H W -> S C T H W
-    clip_seq = clip_seq.reshape(
-        len(start_idx),
+    return get_visual_seqs(
+        frames,
+        start_idx,
+        end_idx,
         video_num_frames,
-        clip_seq.shape[1],
-        clip_seq.shape[2],
-        clip_seq.shape[3],
-    )
-    clip_seq = clip_seq.transpose(1, 2).contiguous()
-
-    return clip_seq
+        crop_size,
+        [spatial_sample_index],
+    )[0]
 
 def apply_visual_transform(
     frames,
@@ -158,8 +196,8 @@ def uniform_crop(images, size, spatial_idx):
             `num frames` x `channel` x `size` x `size`.
     """
     assert spatial_idx in [0, 1, 2]
-    height = images.shape[2]
-    width = images.shape[3]
+    height = images.shape[-2]
+    width = images.shape[-1]
 
     y_offset = int(math.ceil((height - size) / 2))
     x_offset = int(math.ceil((width - size) / 2))
@@ -175,7 +213,7 @@ def uniform_crop(images, size, spatial_idx):
         elif spatial_idx == 2:
             x_offset = width - size
     cropped = images[
-        :, :, y_offset : y_offset + size, x_offset : x_offset + size
+        ..., y_offset : y_offset + size, x_offset : x_offset + size
     ]
 
     return cropped
@@ -186,23 +224,22 @@ def color_normalization(images, mean, stddev):
     Args:
         images (tensor): images to perform color normalization. Dimension is
             `num frames` x `channel` x `height` x `width`.
-        mean (list): mean values for normalization.
-        stddev (list): standard deviations for normalization.
+        mean (list or float): mean values for normalization.
+        stddev (list or float): standard deviations for normalization.
 
     Returns:
         out_images (tensor): the noramlized images, the dimension is
             `num frames` x `channel` x `height` x `width`.
     """
-    assert len(mean) == images.shape[1], "channel mean not computed properly"
-    assert (
-        len(stddev) == images.shape[1]
-    ), "channel stddev not computed properly"
-
-    out_images = torch.zeros_like(images)
-    for idx in range(len(mean)):
-        out_images[:, idx] = (images[:, idx] - mean[idx]) / stddev[idx]
+    if isinstance(mean, (list, tuple)):
+        assert len(mean) == images.shape[-3], "channel mean not computed properly"
+        assert (
+            len(stddev) == images.shape[-3]
+        ), "channel stddev not computed properly"
+        mean = images.new_tensor(mean).view(-1, 1, 1)
+        stddev = images.new_tensor(stddev).view(-1, 1, 1)
 
-    return out_images
+    return (images - mean) / stddev
 
 def temporal_sampling(frames, start_idx, end_idx, num_samples):
     """
@@ -244,10 +281,19 @@ def get_audio_seq(
         (tensor): a sequence of log-mel-scaled spectrogram with dimension of
             `sequence length` x `channel` x `frequency` x `time`.
     """
+    views = [waveform[:, s:e] for s, e in zip(start_idx, end_idx)]
+    if len({view.size(-1) for view in views}) == 1:
+        # All views share the same length: one batched transform.
+        # S x C x F x T
+        return get_log_mel_spectrogram(
+            torch.stack(views, dim=0),
+            audio_fps,
+            frequency,
+            time
+        )
+
     audio_seq = []
-    for s, e in zip(start_idx, end_idx):
-        # Temporal sampling.
-        waveform_view = waveform[:, s:e]
+    for waveform_view in views:
         # Convert it to log-mel-scaled spectrogram.
         log_mel_spectrogram = get_log_mel_spectrogram(
             waveform_view,
@@ -278,9 +324,7 @@ def resample(waveform, orig_freq, new_freq, use_mono=True):
         waveform = waveform.mean(0, keepdim=True)
 
     if orig_freq != new_freq:
-        waveform = torchaudio.transforms.Resample(
-            orig_freq, new_freq,
-        )(waveform)
+        waveform = audio_ops.resample(waveform, orig_freq, new_freq)
 
     return waveform
 
@@ -294,32 +338,26 @@ def get_log_mel_spectrogram(
     Convert the input waveform to log-mel-scaled spectrogram.
     args:
         waveform (tensor): input waveform. The dimension is
-            `channel` x `time.`
+            `channel` x `time`, with optional leading batch dimensions.
         `audio_fps` (int): sampling rate of `waveform`.
         `frequency` (int): target frequecy dimension (number of mel bins).
         `time` (int): target time dimension.
     returns:
         (tensor): log-mel-scaled spectrogram with dimension of
-            `channel` x `frequency` x `time`.
+            (batch x) `channel` x `frequency` x `time`.
     """
     w = waveform.size(-1)
     n_fft = 2 * (math.floor(w / time) + 1)
-    mel_spectrogram = torchaudio.transforms.MelSpectrogram(
-        audio_fps, n_fft=n_fft, n_mels=frequency,
-    )(waveform)
+    mel_spectrogram = get_mel_spectrogram(audio_fps, n_fft, frequency)(waveform)
     log_mel_spectrogram = torch.log(1e-6 + mel_spectrogram)
-    _nchannels, _frequency, _time = log_mel_spectrogram.size()
+    *_batch, _frequency, _time = log_mel_spectrogram.size()
     assert _frequency == frequency, \
         f"frequency {_frequency} must be {frequency}"
-    if _time != time:
-        t = torch.zeros(
-            _nchannels,
-            frequency,
-            time,
-            dtype=log_mel_spectrogram.dtype,
+    if _time > time:
+        log_mel_spectrogram = log_mel_spectrogram[..., :time]
+    elif _time < time:
+        log_mel_spectrogram = torch.nn.functional.pad(
+            log_mel_spectrogram, (0, time - _time)
         )
-        min_time = min(time, _time)
-        t[:, :, :min_time] = log_mel_spectrogram[:, :, :min_time]
-        log_mel_spectrogram = t
 
     return log_mel_spectrogram
@@ -6,12 +6,13 @@ from typing import Dict, List, Tuple, Union
 
 import torch
 import torch.nn as nn
-import torchaudio
 import torchaudio.transforms as aT
 import torchvision
 from torch import Tensor
 from torch.nn.utils.rnn import pad_sequence
 
+from utils import audio_ops, video_ops
+
 HIDDEN_DIM = 8
 
 
@@ -49,36 +50,25 @@ class UpstreamExpert(nn.Module):
         Replace this function to preprocess videos into your input format
         video: (video_length, video_channels, height, width), where video_channels is usually 3 for RGB or 1 for greyscale
         """
-        # Resize video frames
-        video_frames = []
-        for frame in video:
-            video_frames.append(
-                torchvision.transforms.functional.resize(
-                    frame, self.video_frame_size, antialias=False
-                )
-            )
-        video = torch.stack(video_frames)
-
         # Resample video
-        # (from https://github.com/pytorch/vision/blob/5b07d6c9c6c14cf88fc545415d63021456874744/torchvision/datasets/video_utils.py#L278)
-        step = float(video_frame_rate) / self.video_frame_rate
-        if step.is_integer():
-            # optimization: if step is integer, don't need to perform
-            # advanced indexing
-            step = int(step)
-            idxs = slice(None, None, step)
-        else:
-            num_frames = int(len(video) / step)
-            idxs = torch.arange(num_frames, dtype=torch.float32) * step
-            idxs = idxs.floor().to(torch.int64)
-        video = video[idxs]
+        video = video[
+            video_ops.resample_indices(
+                len(video), video_frame_rate, self.video_frame_rate, min_frames=0
+            )
+        ]
 
         # Other preprocessing steps (i.e. cropping, flipping, etc.)
         # e.g. take first three frames to ensure all videos have same size
         if video.shape[0] < 3:
             video = video.repeat(3,1,1,1)
         video = video[:3]
-        return video.float()
+
+        # Resize video frames, they stay uint8 until the video encoder converts them
+        # (see utils/video_ops.py for a fused resize, crop and normalization to float)
+        video = torchvision.transforms.functional.resize(
+            video, self.video_frame_size, antialias=False
+        )
+        return video
 
     def preprocess_audio(self, audio, audio_sample_rate):
         """
@@ -90,12 +80,14 @@ class UpstreamExpert(nn.Module):
 
         # Resample audio
         if audio_sample_rate != self.audio_sample_rate:
-            audio = torchaudio.functional.resample(
+            audio = audio_ops.resample(
                 audio, audio_sample_rate, self.audio_sample_rate
             )
 
         # Other preprocessing steps (e.g. trimming, transform to melspectrogram etc.)
-        mel_specgram = self.melspec_transform[0](audio).transpose(0, 2)
+        # (the transform follows the audio, which is on --device with --batched_preprocess)
+        melspec_transform = self.melspec_transform[0].to(audio.device)
+        mel_specgram = melspec_transform(audio).transpose(0, 2)
 
         return mel_specgram
 
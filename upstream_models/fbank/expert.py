@@ -10,12 +10,13 @@
 #   Copyright    [ Copyleft(c), Speech Lab, NTU, Taiwan ]
 """*********************************************************************************************"""
 
+import torch
 import yaml
 from torch.nn.utils.rnn import pad_sequence
 
 from interfaces import UpstreamBase
+from utils import audio_ops
 from .extracter import get_extracter
-import torchaudio
 # from .preprocessor import get_preprocessor
 
 SAMPLE_RATE = 16000
@@ -50,9 +51,9 @@ class UpstreamExpert(UpstreamBase):
             # )
 
     def _extractor_forward(self, wavs):
-        feats = []
-        for wav in wavs:
-            feats.append(self.extracter(wav))
+        lengths = torch.LongTensor([len(wav) for wav in wavs]).to(wavs[0].device)
+        padded_wavs = pad_sequence(wavs, batch_first=True)
+        feats, _ = self.extracter(padded_wavs, lengths)
         return feats
 
     def get_downsample_rates(self, key: str) -> int:
@@ -71,7 +72,7 @@ class UpstreamExpert(UpstreamBase):
 
         # Resample audio
         if audio_sample_rate != self.audio_sample_rate:
-            audio = torchaudio.functional.resample(
+            audio = audio_ops.resample(
                 audio, audio_sample_rate, self.audio_sample_rate
             )
 
@@ -82,11 +83,10 @@ class UpstreamExpert(UpstreamBase):
         wavs, video = zip(*source)
 
         if "kaldi" in self.config:
-            feats = self._extractor_forward(wavs)
+            padded_feats = self._extractor_forward(wavs)
         else:
             raise NotImplementedError
 
-        padded_feats = pad_sequence(feats, batch_first=True)
         return {
             "audio_feats": [padded_feats],
         }
\ No newline at end of file
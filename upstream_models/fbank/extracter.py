@@ -15,6 +15,7 @@
 ###############
 import copy
 from collections import namedtuple
+from functools import lru_cache
 
 # -------------#
 import torch
@@ -23,6 +24,7 @@ import torch.nn.functional as F
 
 # -------------#
 import torchaudio
+from torch.nn.utils.rnn import pad_sequence
 from torchaudio import transforms
 
 ############
@@ -38,12 +40,136 @@ def get_extracter(config):
         Delta(**config.get("delta", {})),
         CMVN(**config.get("cmvn", {})),
     ]
-    extracter = nn.Sequential(*transforms)
+    extracter = Extracter(*transforms)
     output_dim = extracter(torch.randn(EXAMPLE_SEC * SAMPLE_RATE)).size(-1)
 
     return extracter, output_dim, extracter[0].frame_shift
 
 
+def _length_mask(lengths, max_len):
+    # (batch_size, max_len), True for the valid frames
+    return torch.arange(max_len, device=lengths.device) < lengths.unsqueeze(1)
+
+
+class Extracter(nn.Sequential):
+    """
+    nn.Sequential of the feature transforms. Called with lengths, it takes a zero-padded
+    batch of waveforms (batch_size, max_len) and returns the zero-padded features
+    (batch_size, max_seqlen, feat_dim) with their lengths.
+    """
+
+    def forward(self, x, lengths=None):
+        if lengths is None:
+            return super().forward(x)
+        for module in self:
+            x, lengths = module.batch_forward(x, lengths)
+        return x, lengths
+
+
+# kaldi.fbank options supported by ExtractAudioFeature's batched path
+BATCHED_FBANK_DEFAULTS = {
+    "num_mel_bins": 23,
+    "frame_length": 25.0,
+    "frame_shift": 10.0,
+    "use_log_fbank": True,
+    "use_power": True,
+    "preemphasis_coefficient": 0.97,
+    "window_type": "povey",
+    "low_freq": 20.0,
+    "high_freq": 0.0,
+    "remove_dc_offset": True,
+    "round_to_power_of_two": True,
+    "dither": 0.0,
+    "use_energy": False,
+    "snip_edges": True,
+}
+
+
+def _feature_window(window_type, window_size, device, dtype):
+    # same windows as torchaudio.compliance.kaldi
+    if window_type == "hanning":
+        return torch.hann_window(window_size, periodic=False, device=device, dtype=dtype)
+    elif window_type == "hamming":
+        return torch.hamming_window(
+            window_size, periodic=False, alpha=0.54, beta=0.46, device=device, dtype=dtype
+        )
+    elif window_type == "povey":
+        return torch.hann_window(window_size, periodic=False, device=device, dtype=dtype).pow(0.85)
+    elif window_type == "rectangular":
+        return torch.ones(window_size, device=device, dtype=dtype)
+    else:
+        raise Exception("Invalid window type " + window_type)
+
+
+@lru_cache(maxsize=None)
+def _mel_banks(num_mel_bins, padded_window_size, low_freq, high_freq, device, dtype):
+    # kaldi.get_mel_banks (without vtln) as a (padded_window_size // 2 + 1, num_mel_bins)
+    # matrix on device, computed once per configuration instead of once per batch
+    mel_banks, _ = torchaudio.compliance.kaldi.get_mel_banks(
+        num_mel_bins, padded_window_size, float(SAMPLE_RATE), low_freq, high_freq, 100.0, -500.0, 1.0
+    )
+    mel_banks = F.pad(mel_banks, (0, 1), mode="constant", value=0)
+    return mel_banks.t().to(device=device, dtype=dtype)
+
+
+def batched_fbank(
+    waveforms,
+    lengths,
+    num_mel_bins=23,
+    frame_length=25.0,
+    frame_shift=10.0,
+    use_log_fbank=True,
+    use_power=True,
+    preemphasis_coefficient=0.97,
+    window_type="povey",
+    low_freq=20.0,
+    high_freq=0.0,
+    remove_dc_offset=True,
+    round_to_power_of_two=True,
+    **kwargs,
+):
+    """
+    torchaudio.compliance.kaldi.fbank for a zero-padded batch (batch_size, max_len),
+    with dither=0, use_energy=False and snip_edges=True
+    """
+    window_shift = int(SAMPLE_RATE * frame_shift * 0.001)
+    window_size = int(SAMPLE_RATE * frame_length * 0.001)
+    padded_window_size = (
+        1 << (window_size - 1).bit_length() if round_to_power_of_two else window_size
+    )
+    num_frames = (
+        1 + torch.div(lengths - window_size, window_shift, rounding_mode="floor")
+    ).clamp(min=0)
+
+    if waveforms.size(1) < window_size:
+        waveforms = F.pad(waveforms, (0, window_size - waveforms.size(1)))
+    # (batch_size, max_seqlen, window_size)
+    frames = waveforms.unfold(1, window_size, window_shift)
+
+    if remove_dc_offset:
+        frames = frames - frames.mean(dim=-1, keepdim=True)
+    if preemphasis_coefficient != 0.0:
+        previous = torch.cat((frames[..., :1], frames[..., :-1]), dim=-1)
+        frames = frames - preemphasis_coefficient * previous
+
+    window = _feature_window(window_type, window_size, frames.device, frames.dtype)
+    frames = F.pad(frames * window, (0, padded_window_size - window_size))
+
+    spectrum = torch.fft.rfft(frames).abs()
+    if use_power:
+        spectrum = spectrum.pow(2.0)
+
+    mel_banks = _mel_banks(
+        num_mel_bins, padded_window_size, float(low_freq), float(high_freq), frames.device, frames.dtype
+    )
+    mel_energies = spectrum.matmul(mel_banks)
+    if use_log_fbank:
+        mel_energies = mel_energies.clamp(min=torch.finfo(mel_energies.dtype).eps).log()
+
+    mel_energies = mel_energies * _length_mask(num_frames, mel_energies.size(1)).unsqueeze(-1)
+    return mel_energies, num_frames
+
+
 class ExtractAudioFeature(nn.Module):
     def __init__(self, feat_type="fbank", **kwargs):
         super(ExtractAudioFeature, self).__init__()
@@ -59,6 +185,26 @@ class ExtractAudioFeature(nn.Module):
         # x: (feat_seqlen, feat_dim)
         return x
 
+    def batch_forward(self, waveforms, lengths):
+        # waveforms: (batch_size, max_len)
+        options = {**BATCHED_FBANK_DEFAULTS, **self.kwargs}
+        batchable = (
+            self.extract_fn is torchaudio.compliance.kaldi.fbank
+            and options.keys() == BATCHED_FBANK_DEFAULTS.keys()
+            and options["dither"] == 0.0
+            and not options["use_energy"]
+            and options["snip_edges"]
+            and options["window_type"] in ("povey", "hamming", "hanning", "rectangular")
+        )
+        if not batchable:
+            xs = [self.forward(wav[:length]) for wav, length in zip(waveforms, lengths)]
+            lengths = torch.LongTensor([len(x) for x in xs]).to(lengths.device)
+            return pad_sequence(xs, batch_first=True), lengths
+
+        x, lengths = batched_fbank(waveforms, lengths, **self.kwargs)
+        # x: (batch_size, max_seqlen, feat_dim)
+        return x, lengths
+
 
 class Delta(nn.Module):
     def __init__(self, order=2, **kwargs):
@@ -77,6 +223,30 @@ class Delta(nn.Module):
         # x: (feat_seqlen, feat_dim)
         return x
 
+    def batch_forward(self, x, lengths):
+        # x: (batch_size, max_seqlen, feat_dim)
+        # replicate padding at each utterance's own last frame, not at the batch padding
+        n = (self.compute_delta.win_length - 1) // 2
+        assert self.compute_delta.mode == "replicate", "batched Delta only supports replicate padding"
+        denom = n * (n + 1) * (2 * n + 1) / 3
+        offsets = torch.arange(-n, n + 1, device=x.device)
+        idxs = torch.arange(x.size(1), device=x.device).view(1, -1, 1) + offsets
+        idxs = idxs.clamp(min=0).minimum((lengths - 1).clamp(min=0).view(-1, 1, 1))
+        batch_size, max_seqlen, num_taps = idxs.shape
+        mask = _length_mask(lengths, max_seqlen).unsqueeze(-1)
+
+        feats = [x]
+        for o in range(self.order):
+            last = feats[-1]
+            window = last.gather(
+                1, idxs.reshape(batch_size, -1, 1).expand(-1, -1, last.size(-1))
+            ).view(batch_size, max_seqlen, num_taps, -1)
+            delta = (window * offsets.to(x.dtype).view(1, 1, -1, 1)).sum(dim=2) / denom
+            feats.append(delta * mask)
+        x = torch.cat(feats, dim=-1)
+        # x: (batch_size, max_seqlen, feat_dim)
+        return x, lengths
+
 
 class CMVN(nn.Module):
     def __init__(self, use_cmvn, eps=1e-10):
@@ -90,4 +260,14 @@ class CMVN(nn.Module):
             x = (x - x.mean(dim=0, keepdim=True)) / (
                 self.eps + x.std(dim=0, keepdim=True)
             )
-        return x
\ No newline at end of file
+        return x
+
+    def batch_forward(self, x, lengths):
+        # x: (batch_size, max_seqlen, feat_dim), statistics over each utterance's own frames
+        if self.use_cmvn:
+            mask = _length_mask(lengths, x.size(1)).unsqueeze(-1).to(x.dtype)
+            count = lengths.to(x.dtype).view(-1, 1, 1)
+            mean = (x * mask).sum(dim=1, keepdim=True) / count
+            std = (((x - mean) * mask).pow(2).sum(dim=1, keepdim=True) / (count - 1)).sqrt()
+            x = (x - mean) / (self.eps + std) * mask
+        return x, lengths
\ No newline at end of file
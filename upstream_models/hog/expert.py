@@ -1,15 +1,14 @@
 import yaml
-import torch
 import torch.nn as nn
 import torchaudio
 import torchaudio.transforms as aT
-import torchvision
 from torch import Tensor
 from torch.nn.utils.rnn import pad_sequence
 
 from interfaces import UpstreamBase
+from utils import video_ops
 
-from skimage.feature import hog
+from .feature import hog
 
 ###################
 # UPSTREAM EXPERT #
@@ -26,35 +25,18 @@ class UpstreamExpert(UpstreamBase):
             self.config = yaml.load(file, Loader=yaml.FullLoader)
 
     def preprocess_video(self, video, video_frame_rate):
-        
-        # Resize video frames
-        video_frames = []
-        for frame in video:
-            video_frames.append(
-                torchvision.transforms.functional.resize(
-                    frame, self.video_frame_size, antialias=False
-                )
-            )
-        video = torch.stack(video_frames)
 
-        # Resample video
-        # (from https://github.com/pytorch/vision/blob/5b07d6c9c6c14cf88fc545415d63021456874744/torchvision/datasets/video_utils.py#L278)
-        step = float(video_frame_rate) / self.video_frame_rate
-        if step.is_integer():
-            # optimization: if step is integer, don't need to perform
-            # advanced indexing
-            step = int(step)
-            idxs = slice(None, None, step)
-        else:
-            num_frames = max(int(len(video) / step), 1)
-            idxs = torch.arange(num_frames, dtype=torch.float32) * step
-            idxs = idxs.floor().to(torch.int64)
-        video = video[idxs]
-
-        if video.shape[1] == 3:
-            video = 0.2989 * video[:, 0] + 0.587 * video[:, 1] + 0.114 * video[:, 2]
-        else:
-            video = video.mean(dim=1)
+        # Resample, resize and transform to greyscale, resizing the uint8 frames
+        # first as the original per-frame resize
+        video = video_ops.transform(
+            video,
+            video_frame_rate,
+            self.video_frame_rate,
+            size=self.video_frame_size,
+            grey=True,
+            antialias=False,
+            resize_first=True,
+        )
 
         return video
     
@@ -80,16 +62,8 @@ class UpstreamExpert(UpstreamBase):
 
         videos = pad_sequence(video, batch_first = True)
 
-        video_feats = []
-        for video in videos:
-            video_feat = []
-            for frame in video:
-                feat = hog(frame.cpu(), orientations=8, pixels_per_cell=(16, 16), cells_per_block=(1, 1))
-                feat = torch.from_numpy(feat)
-                video_feat.append(feat)
-            video_feat = torch.stack(video_feat)
-            video_feats.append(video_feat)
-        video_feats = torch.stack(video_feats).cuda()
+        # all B x T frames at once, on the frames' device
+        video_feats = hog(videos, orientations=8, pixels_per_cell=(16, 16), cells_per_block=(1, 1))
 
         return {
             "video_feats": [video_feats],
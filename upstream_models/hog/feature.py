@@ -0,0 +1,55 @@
+import torch
+import torch.nn.functional as F
+
+# --------------------------------------------------------
+# Batched Histogram of Oriented Gradients, matching
+# skimage.feature.hog(frame, orientations, pixels_per_cell, cells_per_block)
+# (block_norm='L2-Hys', transform_sqrt=False, feature_vector=True)
+# for every greyscale frame of a batch at once, on the frames' device
+# --------------------------------------------------------
+
+
+def _normalize_blocks(blocks, eps=1e-5):
+    """
+    L2-Hys normalization over the last three dims (block rows, block cols, orientations)
+    """
+    dims = (-3, -2, -1)
+    out = blocks / torch.sqrt(blocks.pow(2).sum(dim=dims, keepdim=True) + eps**2)
+    out = out.clamp(max=0.2)
+    return out / torch.sqrt(out.pow(2).sum(dim=dims, keepdim=True) + eps**2)
+
+
+def hog(frames, orientations=9, pixels_per_cell=(8, 8), cells_per_block=(3, 3)):
+    """
+    frames: (..., height, width) greyscale frames
+    Returns (..., num_features), the flattened normalized blocks of each frame
+    """
+    *batch_shape, s_row, s_col = frames.shape
+    image = frames.reshape(-1, s_row, s_col)
+    if not image.is_floating_point():
+        image = image.float()
+
+    # centered gradients, zero on the borders
+    g_row = F.pad(image[:, 2:, :] - image[:, :-2, :], (0, 0, 1, 1))
+    g_col = F.pad(image[:, :, 2:] - image[:, :, :-2], (1, 1, 0, 0))
+
+    magnitude = torch.hypot(g_col, g_row)
+    orientation = torch.rad2deg(torch.atan2(g_row, g_col)) % 180
+
+    # bin i holds the orientations in [i, i + 1) * 180 / orientations
+    bins = torch.floor(orientation / (180 / orientations)).long()
+    magnitude = magnitude * (bins < orientations)
+    histogram = image.new_zeros(image.size(0), orientations, s_row, s_col)
+    histogram.scatter_add_(1, bins.clamp(max=orientations - 1).unsqueeze(1), magnitude.unsqueeze(1))
+
+    # cell averages, cells past the last whole cell are dropped
+    c_row, c_col = pixels_per_cell
+    histogram = F.avg_pool2d(histogram, kernel_size=(c_row, c_col))
+
+    # (N, n_blocks_row, n_blocks_col, b_row, b_col, orientations)
+    b_row, b_col = cells_per_block
+    blocks = histogram.unfold(2, b_row, 1).unfold(3, b_col, 1)
+    blocks = blocks.permute(0, 2, 3, 4, 5, 1)
+    blocks = _normalize_blocks(blocks)
+
+    return blocks.reshape(*batch_shape, -1)
@@ -16,10 +16,10 @@ import logging
 import torch
 import torch.nn.functional as F
 from torch.nn.utils.rnn import pad_sequence
-import torchaudio
 
 import fairseq
 from interfaces import UpstreamBase
+from utils import audio_ops
 
 logger = logging.getLogger(__name__)
 
@@ -70,7 +70,7 @@ class UpstreamExpert(UpstreamBase):
 
         # Resample audio
         if audio_sample_rate != self.audio_sample_rate:
-            audio = torchaudio.functional.resample(
+            audio = audio_ops.resample(
                 audio, audio_sample_rate, self.audio_sample_rate
             )
 
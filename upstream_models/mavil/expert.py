@@ -3,21 +3,59 @@ from typing import Dict, List, Tuple, Union
 import math
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import torchaudio
 
 from torch import Tensor
 from torch.nn.utils.rnn import pad_sequence
 
-from torchvision.transforms import Compose, Resize 
-from torchvision.transforms._transforms_video import ToTensorVideo, NormalizeVideo
 
 from . import models_vitmm
 
+from .util.fbank import kaldi_fbank, num_fbank_frames
 from .util.patch_embed import PatchEmbed_new
+from utils import audio_ops, video_ops
 from timm.models.layers import to_2tuple
 
+
+def _pool(tokens, padding_mask=None):
+    """
+    Mean over the token axis, excluding the padded tokens
+    """
+    if padding_mask is None:
+        return tokens.mean(dim=1, keepdim=True)
+    valid = (~padding_mask).unsqueeze(-1).to(tokens.dtype)
+    return (tokens * valid).sum(dim=1, keepdim=True) / valid.sum(dim=1, keepdim=True)
+
+
+def _masked_block(blk, x, attn_mask):
+    """
+    Forward of a timm (0.4.5) ViT Block with an additive attention mask
+    """
+    attn = blk.attn
+    B, N, C = x.shape
+    qkv = attn.qkv(blk.norm1(x)).reshape(B, N, 3, attn.num_heads, C // attn.num_heads).permute(2, 0, 3, 1, 4)
+    q, k, v = qkv[0], qkv[1], qkv[2]
+
+    scores = (q @ k.transpose(-2, -1)) * attn.scale + attn_mask
+    scores = attn.attn_drop(scores.softmax(dim=-1))
+    h = (scores @ v).transpose(1, 2).reshape(B, N, C)
+    h = attn.proj_drop(attn.proj(h))
+
+    x = x + blk.drop_path(h)
+    x = x + blk.drop_path(blk.mlp(blk.norm2(x)))
+    return x
+
+
 class UpstreamExpert(nn.Module):
-    def __init__(self, ckpt: str = None, model_config: str = None, **kwargs):
+    def __init__(
+        self,
+        ckpt: str = None,
+        model_config: str = None,
+        batched_fbank: bool = False,
+        variable_length_audio: bool = False,
+        **kwargs,
+    ):
         """
         Args:
             ckpt:
@@ -25,6 +63,16 @@ class UpstreamExpert(nn.Module):
 
             model_config:
                 config path for your model.
+
+            batched_fbank:
+                preprocess_audio only returns the mono waveform at audio_conf's sample rate,
+                and the fbank, pad/crop and normalization run for the whole batch on the
+                model's device in forward.
+
+            variable_length_audio:
+                fbanks are only padded to a whole number of patches instead of target_length,
+                batches are padded to the longest clip and the padded audio patches are masked
+                out of the attention and of the pooled features.
         """
         super().__init__()
 
@@ -62,48 +110,132 @@ class UpstreamExpert(nn.Module):
                     'noise': False,
                     }
         
+        self.batched_fbank = batched_fbank
+        self.variable_length_audio = variable_length_audio
+        # kept as a plain attribute for the preprocessor (see interfaces.UpstreamPreprocessor)
+        self.audio_patch_size = self.model.patch_embed.patch_size[0]
+
         self.video_frame_size = (224, 224)
         self.video_len = 4                  # MAViL takes 4 sec clips
         self.video_frame_rate = 2           # at 2 frames per second
 
-        self.video_transform = Compose([
-            ToTensorVideo(),
-            Resize((224,224)),
-            NormalizeVideo((0.485, 0.456, 0.406), (0.229, 0.224, 0.225))
-        ])
+        self.video_mean = (0.485, 0.456, 0.406)
+        self.video_std = (0.229, 0.224, 0.225)
+
+        # "audio" | "video" | "fusion" | None, see set_feature_selection
+        self.stream = None
+        # {"audio"|"video"|"fusion": sorted layer ids}, see set_output_layers
+        self.output_layers = {}
+
+    def set_feature_selection(self, feature_selection):
+        """
+        Only run the branches `feature_selection` depends on: the video encoder
+        is skipped for audio keys and vice versa, and the fusion blocks only run
+        for fusion keys. Call with None to restore the full forward.
+        """
+        stream = feature_selection.split("_")[0] if feature_selection else None
+        self.stream = stream if stream in ("audio", "video", "fusion") else None
+
+    def set_output_layers(self, feature_selection, layers=None):
+        """
+        Only compute the hidden states listed in `layers` for `feature_selection`.
+        The encoder producing it stops after the deepest requested block, and the
+        unrequested hidden states are returned as None.
+        Call with layers=None to restore the full forward.
+        """
+        stream = feature_selection.split("_")[0]
+        self.output_layers = {} if layers is None else {stream: sorted(set(layers))}
+
+    def _encode(self, blocks, x, layers=None, padding_mask=None):
+        """
+        Run the unimodal transformer blocks, collecting the hidden states
+        (CLS token dropped) before every block and after the last one
+        padding_mask: (batch_size, num_tokens), True for padded tokens
+        """
+        depth = len(blocks) if layers is None else layers[-1]
+        if padding_mask is not None:
+            attn_mask = x.new_zeros(padding_mask.shape).masked_fill(padding_mask, float("-inf"))
+            attn_mask = attn_mask[:, None, None, :]
+            token_padding_mask = padding_mask[:, 1:]
+        else:
+            token_padding_mask = None
+
+        seq_feats, pooled_feats = [], []
+        for layer_id in range(depth + 1):
+            if layers is None or layer_id in layers:
+                seq_feats.append(x[:, 1:, :]) # drop CLS token
+                pooled_feats.append(_pool(x[:, 1:, :], token_padding_mask)) # drop CLS token and pool
+            else:
+                seq_feats.append(None)
+                pooled_feats.append(None)
+            if layer_id < depth:
+                if padding_mask is None:
+                    x = blocks[layer_id](x)
+                else:
+                    x = _masked_block(blocks[layer_id], x, attn_mask)
+        return x, seq_feats, pooled_feats
+
+    def _audio_padding_mask(self, lengths, max_length):
+        """
+        lengths: number of fbank frames of each clip, multiples of the patch size
+        Returns (batch_size, 1 + num_patches), True for padded patches (the CLS token is kept)
+        """
+        patch_t = self.audio_patch_size
+        n_freq_patches = self.model.patch_embed.patch_hw[1]
+        # patches are ordered time-major, each time step holds n_freq_patches patches
+        num_patches = lengths // patch_t * n_freq_patches
+        max_patches = max_length // patch_t * n_freq_patches
+        padding_mask = torch.arange(max_patches, device=lengths.device) >= num_patches.unsqueeze(1)
+        return F.pad(padding_mask, (1, 0), value=False)
 
     def preprocess_video(self, video, video_frame_rate):
-        
-        # 1. TCHW -> THWC and repeat until four sec. if too short
-        video = torch.permute(video, (0,2,3,1))
+        # video: (video_length, video_channels, height, width), uint8
+
+        # 1. Indices of the frames to keep, clips shorter than four sec. are
+        # repeated by wrapping the indices around instead of copying frames
+        n_frm = video.shape[0]
         n_target_frm = math.ceil(self.video_len * video_frame_rate)
-        if video.shape[0] < n_target_frm:
-            n_repeats = n_target_frm//video.shape[0] + 1
-            video = video.repeat(n_repeats,1,1,1)
+        if n_frm < n_target_frm:
+            n_total_frm = n_frm * (n_target_frm // n_frm + 1)
+        else:
+            n_total_frm = n_frm
 
         # 2. Resample video
         # (from https://github.com/pytorch/vision/blob/5b07d6c9c6c14cf88fc545415d63021456874744/torchvision/datasets/video_utils.py#L278)
         step = float(video_frame_rate) / self.video_frame_rate
         if step.is_integer():
-            # optimization: if step is integer, don't need to perform
-            # advanced indexing
-            step = int(step)
-            idxs = slice(None, None, step)
+            idxs = torch.arange(0, n_total_frm, int(step))
         else:
-            num_frames = max(int(len(video) / step), 1)
+            num_frames = max(int(n_total_frm / step), 1)
             idxs = torch.arange(num_frames, dtype=torch.float32) * step
             idxs = idxs.floor().to(torch.int64)
-        video = video[idxs]
 
         # 3. Crop to 4 seconds
-        video = video[:self.video_len * self.video_frame_rate] # 8 frames per clip
+        idxs = idxs[:self.video_len * self.video_frame_rate] % n_frm # 8 frames per clip
+
+        # 4. Only the kept frames are converted, resized in one call and normalized
+        video = video_ops.transform(
+            video[idxs],
+            size=self.video_frame_size,
+            mean=self.video_mean,
+            std=self.video_std,
+            scale=255.0,
+        )
+
+        # TCHW -> CTHW
+        return video.transpose(0, 1)
 
-        preprocessed_video = self.video_transform(video)
-        return preprocessed_video
-    
     def preprocess_audio(self, audio, audio_sample_rate, fbank_mean=None, fbank_std=None):
         if len(audio.shape) == 2:
             audio = audio.mean(dim=0)
+
+        if self.batched_fbank:
+            # forward only knows a single sample rate for the batch
+            sample_rate = self.audio_conf.get('sample_rate')
+            if audio_sample_rate != sample_rate:
+                audio = audio_ops.resample(audio, audio_sample_rate, sample_rate)
+            return audio
+
         waveform = audio.unsqueeze(0)
         waveform = waveform - waveform.mean()
 
@@ -114,6 +246,10 @@ class UpstreamExpert(nn.Module):
                                                   window_type='hanning', num_mel_bins=self.audio_conf.get('num_mel_bins'), dither=0.0, frame_shift=10)
         target_length = self.audio_conf.get('target_length')
         n_frames = fbank.shape[0]
+        if self.variable_length_audio:
+            # only pad to a whole number of patches
+            patch_t = self.audio_patch_size
+            target_length = min(max(math.ceil(n_frames / patch_t), 1) * patch_t, target_length)
 
         p = target_length - n_frames
 
@@ -136,6 +272,54 @@ class UpstreamExpert(nn.Module):
 
         return fbank.unsqueeze(0)
 
+    def batch_fbank(self, wavs, fbank_mean=None, fbank_std=None):
+        """
+        Batched counterpart of preprocess_audio for the batched_fbank mode
+        wavs: list of mono waveforms at audio_conf's sample rate
+        Returns (batch_size, 1, max_length, num_mel_bins) and the per-clip lengths,
+        max_length is target_length unless variable_length_audio is set
+        """
+        sample_rate = self.audio_conf.get('sample_rate')
+        target_length = self.audio_conf.get('target_length')
+        device = wavs[0].device
+
+        lengths = torch.LongTensor([len(wav) for wav in wavs]).to(device)
+        waveforms = pad_sequence(wavs, batch_first=True)
+        sample_mask = torch.arange(waveforms.size(1), device=device) < lengths.unsqueeze(1)
+        waveforms = waveforms - (waveforms.sum(dim=1) / lengths).unsqueeze(1)
+        waveforms = waveforms * sample_mask
+
+        fbank = kaldi_fbank(waveforms, sample_rate, num_mel_bins=self.audio_conf.get('num_mel_bins'))
+        num_frames = num_fbank_frames(lengths, sample_rate)
+
+        if self.variable_length_audio:
+            # only pad to a whole number of patches
+            patch_t = self.audio_patch_size
+            fbank_lengths = (torch.div(num_frames + patch_t - 1, patch_t, rounding_mode="floor") * patch_t)
+            fbank_lengths = fbank_lengths.clamp(min=patch_t, max=target_length)
+        else:
+            fbank_lengths = torch.full_like(num_frames, target_length)
+        max_length = int(fbank_lengths.max())
+
+        # cut and pad, frames past each clip's end are zeros
+        fbank = fbank[:, :max_length]
+        if fbank.size(1) < max_length:
+            fbank = F.pad(fbank, (0, 0, 0, max_length - fbank.size(1)))
+        frames = torch.arange(max_length, device=device)
+        fbank = fbank * (frames < num_frames.unsqueeze(1)).unsqueeze(-1)
+
+        # normalize fbank (allow precomputed mean/std), per clip over its padded spectrogram
+        region = (frames < fbank_lengths.unsqueeze(1)).unsqueeze(-1).to(fbank.dtype)
+        if fbank_mean is None or fbank_std is None:
+            num_values = (fbank_lengths * fbank.size(-1)).to(fbank.dtype).view(-1, 1, 1)
+            fbank_mean = fbank.sum(dim=(1, 2), keepdim=True) / num_values
+            fbank_std = (
+                ((fbank - fbank_mean) * region).pow(2).sum(dim=(1, 2), keepdim=True) / (num_values - 1)
+            ).sqrt()
+        fbank = (fbank - fbank_mean) / (fbank_std * 2) * region
+
+        return fbank.unsqueeze(1), fbank_lengths
+
     def forward(
         self, source: List[Tuple[Tensor, Tensor]]
     ) -> Dict[str, Union[Tensor, List[Tensor]]]:
@@ -146,73 +330,99 @@ class UpstreamExpert(nn.Module):
                 in your input format
         """
         audio, video = zip(*source)
-        x = torch.stack(audio, dim=0)
-        v = torch.stack(video, dim=0)
-        v = v[:,:,:self.model.n_frm,:,:]
-
-        B = x.shape[0]
-
-        # audio
-        x = self.model.patch_embed(x)
-        x = x + self.model.pos_embed[:, 1:, :]
-        cls_token = self.model.cls_token + self.model.pos_embed[:, :1, :]
-        cls_tokens = cls_token.expand(B, -1, -1)  # cls_tokens impl from Phil Wang, thanks
-        x = torch.cat((cls_tokens, x), dim=1)
-        x = self.model.pos_drop(x)
-
-        # audio encoding
-        audio_seq_feats = []
-        audio_pooled_feats = []
-        for blk in self.model.blocks:
-            audio_seq_feats.append(x[:, 1:, :]) # drop CLS token
-            audio_pooled_feats.append(x[:, 1:, :].mean(dim=1, keepdim=True)) # drop CLS token and pool
-            x = blk(x)
-
-        audio_seq_feats.append(x[:, 1:, :]) # drop CLS token
-        audio_pooled_feats.append(x[:, 1:, :].mean(dim=1, keepdim=True)) # drop CLS token and pool
-
-        # video
-        v = self.model.patch_embed_v(v)
-        v = v + self.model.pos_embed_v[:, 1:, :]
-        cls_token_v = self.model.cls_token_v + self.model.pos_embed_v[:, :1, :]
-        cls_tokens_v = cls_token_v.expand(B, -1, -1)
-        v = torch.cat((cls_tokens_v, v), dim=1)
-        v = self.model.pos_drop(v)
-
-        # video encoding
-        video_seq_feats = []
-        video_pooled_feats = []
-        for blk in self.model.blocks_v:
-            video_seq_feats.append(v[:, 1:, :]) # drop CLS token
-            video_pooled_feats.append(v[:, 1:, :].mean(dim=1, keepdim=True)) # drop CLS token and pool
-            v = blk(v)
-        
-        video_seq_feats.append(v[:, 1:, :]) # drop CLS token
-        video_pooled_feats.append(v[:, 1:, :].mean(dim=1, keepdim=True)) # drop CLS token and pool
-
+        B = len(source)
+        results = {}
+
+        # skip the encoders the selected feature does not depend on
+        run_audio = self.stream != "video"
+        run_video = self.stream != "audio"
+
+        audio_layers = self.output_layers.get("audio")
+        if run_audio:
+            audio_padding_mask = None
+            if self.batched_fbank:
+                x, audio_lengths = self.batch_fbank(audio)
+            elif self.variable_length_audio:
+                audio_lengths = torch.LongTensor([a.shape[-2] for a in audio]).to(audio[0].device)
+                x = pad_sequence([a[0] for a in audio], batch_first=True).unsqueeze(1)
+            else:
+                x = torch.stack(audio, dim=0)
+            if self.variable_length_audio:
+                audio_padding_mask = self._audio_padding_mask(audio_lengths, x.shape[2])
+
+            # audio, pos_embed is sliced to the (time-major) patches of shorter spectrograms
+            x = self.model.patch_embed(x)
+            x = x + self.model.pos_embed[:, 1:x.shape[1] + 1, :]
+            cls_token = self.model.cls_token + self.model.pos_embed[:, :1, :]
+            cls_tokens = cls_token.expand(B, -1, -1)  # cls_tokens impl from Phil Wang, thanks
+            x = torch.cat((cls_tokens, x), dim=1)
+            x = self.model.pos_drop(x)
+
+            # audio encoding
+            x, audio_seq_feats, audio_pooled_feats = self._encode(
+                self.model.blocks, x, audio_layers, audio_padding_mask
+            )
+            results["audio_feats"] = audio_pooled_feats
+            results["audio_seq_feats"] = audio_seq_feats
+
+        video_layers = self.output_layers.get("video")
+        if run_video:
+            v = torch.stack(video, dim=0)
+            v = v[:,:,:self.model.n_frm,:,:]
+
+            # video
+            v = self.model.patch_embed_v(v)
+            v = v + self.model.pos_embed_v[:, 1:, :]
+            cls_token_v = self.model.cls_token_v + self.model.pos_embed_v[:, :1, :]
+            cls_tokens_v = cls_token_v.expand(B, -1, -1)
+            v = torch.cat((cls_tokens_v, v), dim=1)
+            v = self.model.pos_drop(v)
+
+            # video encoding
+            v, video_seq_feats, video_pooled_feats = self._encode(self.model.blocks_v, v, video_layers)
+            results["video_feats"] = video_pooled_feats
+            results["video_seq_feats"] = video_seq_feats
+
+        # fusion needs the full-depth outputs of both unimodal encoders
+        run_fusion = run_audio and run_video and audio_layers is None and video_layers is None
+        if self.model.av_fusion and run_fusion:
+            fusion_layers = self.output_layers.get("fusion")
+            depth = len(self.model.blocks_av) if fusion_layers is None else fusion_layers[-1]
 
-        if self.model.av_fusion:
             x_len = x.shape[1]
             xv = torch.cat((x,v), dim=1)
 
+            fusion_padding_mask = None
+            if audio_padding_mask is not None:
+                fusion_padding_mask = F.pad(audio_padding_mask, (0, v.shape[1]), value=False)
+                fusion_attn_mask = xv.new_zeros(fusion_padding_mask.shape).masked_fill(
+                    fusion_padding_mask, float("-inf")
+                )[:, None, None, :]
+                audio_padding_mask = audio_padding_mask[:, 1:]
+
             fusion_seq_feats = []
             fusion_pooled_feats = []
-            for blk in self.model.blocks_av:
-                
-                fusion_seq_feats.append(xv) 
-                x = xv[:, 1:x_len, :].mean(dim=1, keepdim=True)  # global pool without cls token
-                v = xv[:, x_len+1:,:].mean(dim=1, keepdim=True) # global pool without cls token
-                fusion_pooled_feats.append(torch.cat((x,v),dim=2))
-
-                xv =  blk(xv)
-
-            fusion_seq_feats.append(xv) 
-            x = xv[:, 1:x_len, :].mean(dim=1, keepdim=True)  # global pool without cls token
-            v = xv[:, x_len+1:,:].mean(dim=1, keepdim=True) # global pool without cls token
-            if self.ft:
-                fusion_pooled_feats.append(self.model.fc_norm_av(torch.cat((x,v),dim=2)))
-            else:
-                fusion_pooled_feats.append(torch.cat((x,v),dim=2))
+            for layer_id in range(depth + 1):
+                if fusion_layers is None or layer_id in fusion_layers:
+                    fusion_seq_feats.append(xv)
+                    x = _pool(xv[:, 1:x_len, :], audio_padding_mask)  # global pool without cls token and padding
+                    v = xv[:, x_len+1:,:].mean(dim=1, keepdim=True) # global pool without cls token
+                    if self.ft and layer_id == len(self.model.blocks_av):
+                        fusion_pooled_feats.append(self.model.fc_norm_av(torch.cat((x,v),dim=2)))
+                    else:
+                        fusion_pooled_feats.append(torch.cat((x,v),dim=2))
+                else:
+                    fusion_seq_feats.append(None)
+                    fusion_pooled_feats.append(None)
+
+                if layer_id < depth:
+                    if fusion_padding_mask is None:
+                        xv = self.model.blocks_av[layer_id](xv)
+                    else:
+                        xv = _masked_block(self.model.blocks_av[layer_id], xv, fusion_attn_mask)
+
+            results["fusion_feats"] = fusion_pooled_feats
+            results["fusion_seq_feats"] = fusion_seq_feats
 
         # Return intermediate layer representations for potential layer-wise experiments
         # Dict should contain three items, with keys as listed below:
@@ -220,11 +430,4 @@ class UpstreamExpert(nn.Module):
         # audio_feats: features that only use auditory modality as input
         # fusion_feats: features that consider both modalities
         # Each item should be a list of features that are of the same shape
-        return {
-            "video_feats": video_pooled_feats,
-            "audio_feats": audio_pooled_feats,
-            "fusion_feats": fusion_pooled_feats,
-            "video_seq_feats": video_seq_feats,
-            "audio_seq_feats": audio_seq_feats,
-            "fusion_seq_feats": fusion_seq_feats,
-        }
+        return results
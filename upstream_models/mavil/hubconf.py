@@ -29,3 +29,19 @@ def mavil_base(refresh=False, *args, **kwargs):
     """
     kwargs["ckpt"] = google_large_file_link("160pJQDQGlNwIb5xWlSc73A713I4uXCtg")
     return mavil_url(refresh=refresh, *args, **kwargs)
+
+def mavil_batched_fbank(refresh=False, *args, **kwargs):
+    """
+    The pretrained model, computing the audio fbank for the whole batch on the model's device
+        refresh (bool): whether to download ckpt/config again if existed
+    """
+    kwargs["batched_fbank"] = True
+    return mavil_base(refresh=refresh, *args, **kwargs)
+
+def mavil_variable_length(refresh=False, *args, **kwargs):
+    """
+    The pretrained model, padding audio only to the longest clip of the batch and masking the padding
+        refresh (bool): whether to download ckpt/config again if existed
+    """
+    kwargs["variable_length_audio"] = True
+    return mavil_base(refresh=refresh, *args, **kwargs)
@@ -0,0 +1,75 @@
+from functools import lru_cache
+
+import torch
+import torch.nn.functional as F
+import torchaudio
+
+# --------------------------------------------------------
+# Batched Kaldi-style filterbank, matching
+# torchaudio.compliance.kaldi.fbank(
+#     waveform, htk_compat=True, sample_frequency=sample_rate, use_energy=False,
+#     window_type='hanning', num_mel_bins=num_mel_bins, dither=0.0, frame_shift=10)
+# for every clip of a zero-padded batch at once
+# --------------------------------------------------------
+
+@lru_cache(maxsize=None)
+def _mel_banks(num_mel_bins, padded_window_size, sample_rate, low_freq, high_freq):
+    mel_banks, _ = torchaudio.compliance.kaldi.get_mel_banks(
+        num_mel_bins, padded_window_size, float(sample_rate), low_freq, high_freq, 100.0, -500.0, 1.0
+    )
+    # the Nyquist bin has no mel weight, same as kaldi.fbank
+    return F.pad(mel_banks, (0, 1), mode="constant", value=0)
+
+
+def num_fbank_frames(lengths, sample_rate, frame_length=25.0, frame_shift=10.0):
+    """
+    Number of frames kaldi.fbank (snip_edges=True) returns for waveforms of `lengths` samples
+    """
+    window_shift = int(sample_rate * frame_shift * 0.001)
+    window_size = int(sample_rate * frame_length * 0.001)
+    num_frames = 1 + torch.div(lengths - window_size, window_shift, rounding_mode="floor")
+    return num_frames.clamp(min=0)
+
+
+def kaldi_fbank(
+    waveforms,
+    sample_rate,
+    num_mel_bins=128,
+    frame_length=25.0,
+    frame_shift=10.0,
+    preemphasis_coefficient=0.97,
+    low_freq=20.0,
+    high_freq=0.0,
+):
+    """
+    waveforms: (batch_size, max_len), zero-padded
+    Returns (batch_size, max_frames, num_mel_bins) log mel energies. Frames
+    past each clip's num_fbank_frames overlap the padding and should be discarded.
+    """
+    window_shift = int(sample_rate * frame_shift * 0.001)
+    window_size = int(sample_rate * frame_length * 0.001)
+    padded_window_size = 1 << (window_size - 1).bit_length()
+
+    if waveforms.size(1) < window_size:
+        waveforms = F.pad(waveforms, (0, window_size - waveforms.size(1)))
+
+    # (batch_size, num_frames, window_size)
+    frames = waveforms.unfold(1, window_size, window_shift)
+    frames = frames - frames.mean(dim=-1, keepdim=True)
+
+    # pre-emphasis, replicating the first sample of each frame
+    previous = torch.cat((frames[..., :1], frames[..., :-1]), dim=-1)
+    frames = frames - preemphasis_coefficient * previous
+
+    window = torch.hann_window(
+        window_size, periodic=False, device=frames.device, dtype=frames.dtype
+    )
+    frames = F.pad(frames * window, (0, padded_window_size - window_size))
+
+    power_spectrum = torch.fft.rfft(frames).abs().pow(2.0)
+    mel_banks = _mel_banks(
+        num_mel_bins, padded_window_size, sample_rate, low_freq, high_freq
+    ).to(device=frames.device, dtype=frames.dtype)
+    mel_energies = power_spectrum.matmul(mel_banks.t())
+
+    return mel_energies.clamp(min=torch.finfo(mel_energies.dtype).eps).log()
@@ -5,6 +5,7 @@ Modified from https://github.com/s3prl/s3prl/blob/main/s3prl/upstream/example/ex
 
 import sys
 from collections import OrderedDict
+from functools import lru_cache
 from typing import Dict, List, Tuple, Union
 
 import torch
@@ -13,6 +14,7 @@ import torch.nn as nn
 from . import replai
 from .replai import models
 from .replai.data.builder import build_transforms
+from utils import video_ops
 
 sys.modules["replai"] = replai  # create alias for unpickling
 
@@ -22,8 +24,64 @@ from torch import Tensor
 from torch.nn.utils.rnn import pad_sequence
 
 
+@lru_cache(maxsize=128)
+def build_video_transform(num_frames, crop_size, name="ResizeCropFlip"):
+    """
+    Memoised ResizeCropFlip (or TensorResizeCrop) pipeline (eval mode), keyed by the clip length
+    """
+    return build_transforms(
+        cfg=DefaultMunch.fromDict(
+            {
+                "video": {
+                    "name": name,
+                    "args": {
+                        "min_size": 128,
+                        "max_size": 180,
+                        "crop_size": crop_size[0],
+                    },
+                    "data_shape": [3, num_frames, crop_size[0], crop_size[1]],
+                },
+            }
+        ),
+        augment=False,
+    )
+
+
+@lru_cache(maxsize=128)
+def build_audio_transform(raw_sample_rate, audio_rate, num_temporal_frames):
+    """
+    Memoised ResampleLogMelSpectrogram pipeline (eval mode), keyed by the raw
+    sample rate and the number of mel frames
+    """
+    return build_transforms(
+        cfg=DefaultMunch.fromDict(
+            {
+                "audio": {
+                    "name": "ResampleLogMelSpectrogram",
+                    "args": {
+                        "raw_sample_rate": raw_sample_rate,
+                        "audio_rate": audio_rate,
+                        "mel_window_size": 32,
+                        "mel_step_size": 16,
+                        "num_mels": 80,
+                        "num_temporal_frames": num_temporal_frames,
+                    },
+                    "data_shape": [1, num_temporal_frames, 80],
+                }
+            }
+        ),
+        augment=False,
+    )
+
+
 class UpstreamExpert(nn.Module):
-    def __init__(self, ckpt: str = None, model_config: str = None, **kwargs):
+    def __init__(
+        self,
+        ckpt: str = None,
+        model_config: str = None,
+        video_backend: str = "cv2",
+        **kwargs,
+    ):
         """
         Args:
             ckpt:
@@ -31,6 +89,11 @@ class UpstreamExpert(nn.Module):
 
             model_config:
                 config path for your model.
+
+            video_backend:
+                "cv2" runs the original RepLAI NumPy/OpenCV transforms (reference),
+                "torch" resizes, crops and normalizes the (T, C, H, W) tensor directly
+                without NumPy copies (same nearest-neighbour source pixels).
         """
         super().__init__()
 
@@ -72,6 +135,11 @@ class UpstreamExpert(nn.Module):
         self.audio_sample_rate = 16000
         self.video_frame_size = (112, 112)
         self.video_frame_rate = 16
+        assert video_backend in ("cv2", "torch"), f"unknown video_backend: {video_backend}"
+        self.video_backend = video_backend
+        # the cv2 transforms and the cached resampler / mel spectrogram run on the cpu,
+        # so the runner keeps the preprocessing in the DataLoader workers
+        self.device_preprocess = False
 
     def preprocess_video(self, video, video_frame_rate):
         """
@@ -80,44 +148,19 @@ class UpstreamExpert(nn.Module):
         in RepLAI, the default length is 0.5 secs for video, resulting in 8 frames (16FPS)
         """
         # Resample video
-        # (from https://github.com/pytorch/vision/blob/5b07d6c9c6c14cf88fc545415d63021456874744/torchvision/datasets/video_utils.py#L278)
-        step = float(video_frame_rate) / self.video_frame_rate
-        if step.is_integer():
-            # optimization: if step is integer, don't need to perform
-            # advanced indexing
-            step = int(step)
-            idxs = slice(None, None, step)
+        video = video[video_ops.resample_indices(len(video), video_frame_rate, self.video_frame_rate)]
+
+        if self.video_backend == "torch":
+            _video_transform = build_video_transform(
+                len(video), self.video_frame_size, "TensorResizeCrop"
+            )
+            clips = {"video": (video, self.video_frame_rate)}
         else:
-            num_frames = max(int(len(video) / step),1)
-            idxs = torch.arange(num_frames, dtype=torch.float32) * step
-            idxs = idxs.floor().to(torch.int64)
-        video = video[idxs]
-
-        _video_transform = build_transforms(
-            cfg=DefaultMunch.fromDict(
-                {
-                    "video": {
-                        "name": "ResizeCropFlip",
-                        "args": {
-                            "min_size": 128,
-                            "max_size": 180,
-                            "crop_size": self.video_frame_size[0],
-                        },
-                        "data_shape": [
-                            3,
-                            len(video),
-                            self.video_frame_size[0],
-                            self.video_frame_size[1],
-                        ],
-                    },
-                }
-            ),
-            augment=False,
-        )
-        # Original uses OpenCV for resizing numpy tensors
-        clips = {
-            "video": (video.numpy().transpose(0, 2, 3, 1), self.video_frame_rate),
-        }
+            _video_transform = build_video_transform(len(video), self.video_frame_size)
+            # Original uses OpenCV for resizing numpy tensors
+            clips = {
+                "video": (video.numpy().transpose(0, 2, 3, 1), self.video_frame_rate),
+            }
 
         clips = _video_transform(clips)
 
@@ -136,24 +179,8 @@ class UpstreamExpert(nn.Module):
 
         _audio_length_sec = len(audio) / audio_sample_rate
         num_temporal_frames = int(_audio_length_sec / 2.0 * 128)
-        _audio_transform = build_transforms(
-            cfg=DefaultMunch.fromDict(
-                {
-                    "audio": {
-                        "name": "ResampleLogMelSpectrogram",
-                        "args": {
-                            "raw_sample_rate": audio_sample_rate,
-                            "audio_rate": self.audio_sample_rate,
-                            "mel_window_size": 32,
-                            "mel_step_size": 16,
-                            "num_mels": 80,
-                            "num_temporal_frames": num_temporal_frames,
-                        },
-                        "data_shape": [1, num_temporal_frames, 80],
-                    }
-                }
-            ),
-            augment=False,
+        _audio_transform = build_audio_transform(
+            int(audio_sample_rate), self.audio_sample_rate, num_temporal_frames
         )
 
         clips = {
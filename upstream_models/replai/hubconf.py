@@ -49,6 +49,15 @@ def replai(refresh=False, *args, **kwargs):
     return replai_ek100(refresh=refresh, *args, **kwargs)
 
 
+def replai_torch_video(refresh=False, *args, **kwargs):
+    """
+    The default model, with the tensor-native video transforms
+        refresh (bool): whether to download ckpt/config again if existed
+    """
+    kwargs["video_backend"] = "torch"
+    return replai(refresh=refresh, *args, **kwargs)
+
+
 ############### RepLAI trained on EPIC-KITCHENS-100 ###############
 def replai_ek100(refresh=False, *args, **kwargs):
     """
@@ -1,12 +1,30 @@
+from functools import lru_cache
+
 import numpy as np
 import torch
 from pytorchvideo import transforms as vT
 from torchaudio import transforms as aT
 from torchvision import transforms as T
 
+from utils import audio_ops
+
 from .transforms import audio as aT2
 
 
+# Mel filterbanks only depend on these arguments, share them between the
+# transforms built for different clip lengths (resampling kernels are shared
+# through utils.audio_ops)
+@lru_cache(maxsize=None)
+def cached_mel_spectrogram(sample_rate, n_fft, hop_length, n_mels):
+    return aT.MelSpectrogram(
+        sample_rate=sample_rate,
+        n_fft=n_fft,
+        hop_length=hop_length,
+        n_mels=n_mels,
+        center=False,
+    )
+
+
 class ResampleLogMelSpectrogram:
     def __init__(
         self,
@@ -29,17 +47,8 @@ class ResampleLogMelSpectrogram:
 
         transforms = [
             aT2.ToMono(),
-            aT.Resample(
-                orig_freq=raw_sample_rate,
-                new_freq=audio_rate,
-            ),
-            aT.MelSpectrogram(
-                sample_rate=audio_rate,
-                n_fft=n_fft,
-                hop_length=hop_length,
-                n_mels=num_mels,
-                center=False,
-            ),
+            audio_ops.get_resampler(raw_sample_rate, audio_rate),
+            cached_mel_spectrogram(audio_rate, n_fft, hop_length, num_mels),
             aT2.Log(eps=eps),
             aT2.Permute(0, 2, 1),  # (1, F, T) -> (1, T, F)
             aT2.UniformTemporalSubsample(
@@ -5,7 +5,12 @@ from torchvision import transforms as T
 
 from .transforms import video as vT2
 
-__all__ = ["ResizeCropFlip", "MultiResizeCropFlip", "MultiScaleCropFlipColorJitter"]
+__all__ = [
+    "ResizeCropFlip",
+    "TensorResizeCrop",
+    "MultiResizeCropFlip",
+    "MultiScaleCropFlipColorJitter",
+]
 
 
 class MultiScaleCropFlipColorJitter:
@@ -74,6 +79,71 @@ class ResizeCropFlip:
         return self.t(x)
 
 
+class TensorResizeCrop:
+    """
+    Tensor counterpart of ResizeCropFlip(augment=False) for (T, C, H, W) clips,
+    e.g. uint8 frames straight from the decoder. The nearest-neighbour resize of
+    the short side followed by the center crop only keeps a regular grid of source
+    pixels, so both are done with one row and one column gather (same source
+    indices as cv2.INTER_NEAREST), followed by a single fused normalization.
+    Returns a float tensor of shape (C, T, crop_size, crop_size).
+    """
+
+    def __init__(
+        self,
+        num_frames=8,
+        min_size=256,
+        max_size=360,
+        crop_size=224,
+        augment=False,
+        mean=(0.485, 0.456, 0.406),
+        std=(0.229, 0.224, 0.225),
+    ):
+        if augment:
+            raise NotImplementedError(
+                "TensorResizeCrop only implements the evaluation transform"
+            )
+        self.min_size = min_size
+        self.crop_size = crop_size
+        # (x / 255 - mean) / std == x * scale - shift
+        std = torch.tensor(std)
+        self.scale = (1.0 / (255.0 * std)).view(-1, 1, 1, 1)
+        self.shift = (torch.tensor(mean) / std).view(-1, 1, 1, 1)
+
+    @staticmethod
+    def source_indices(start, size, in_size, out_size):
+        # cv2.INTER_NEAREST: floor(dst * ifx) with ifx = 1 / (out_size / in_size)
+        ifx = 1.0 / (out_size / in_size)
+        idxs = torch.arange(start, start + size, dtype=torch.float64) * ifx
+        return idxs.floor().long().clamp(max=in_size - 1)
+
+    def __call__(self, x, fps):
+        t, c, h, w = x.shape
+        # Min spatial dim already matches minimal size
+        if (w <= h and w == self.min_size) or (h <= w and h == self.min_size):
+            new_h, new_w = h, w
+        else:
+            new_h, new_w = vT2.get_resize_sizes(h, w, self.min_size)
+        if self.crop_size > new_w or self.crop_size > new_h:
+            raise ValueError(
+                "Initial image size should be larger then "
+                "cropped size but got cropped sizes : ({w}, {h}) while "
+                "initial image is ({im_w}, {im_h})".format(
+                    im_w=new_w, im_h=new_h, w=self.crop_size, h=self.crop_size
+                )
+            )
+        y1 = int(round((new_h - self.crop_size) / 2.0))
+        x1 = int(round((new_w - self.crop_size) / 2.0))
+
+        rows = self.source_indices(y1, self.crop_size, h, new_h).to(x.device)
+        cols = self.source_indices(x1, self.crop_size, w, new_w).to(x.device)
+        clip = x.index_select(2, rows).index_select(3, cols).transpose(0, 1)
+
+        scale = self.scale.to(x.device)
+        shift = self.shift.to(x.device)
+        return clip.float().mul_(scale).sub_(shift)
+
+
 class UniformClips:
     def __init__(
         self, num_clips, clip_duration, transform, transform_args, augment=True
@@ -10,21 +10,87 @@ import argparse
 from concurrent.futures import process
 
 import fairseq
-import numpy as np
 import torch
 import torch.nn.functional as F
-import torchaudio
 from packaging import version
 from torch.nn.utils.rnn import pad_sequence
 from torchvision.transforms.functional import rgb_to_grayscale
 
 from interfaces import UpstreamBase
+from utils import audio_ops, video_ops
 
 from . import utils as custom_utils
 from .hubert import AVHubertConfig, AVHubertModel
 
 
-class UpstreamExpert(UpstreamBase):
+class AudioPreprocessMixin:
+    """
+    Audio preprocessing shared by UpstreamExpert and FinetunedUpstreamExpert,
+    relies on their audio_sample_rate and cfg (stack_order_audio, normalize)
+    """
+
+    def batch_preprocess_audio(self, audio, audio_lengths):
+        """
+        logfbank + stacking (+ normalization) for a batch of mono waveforms at self.audio_sample_rate
+        Args:
+        audio - torch.Tensor of shape [B, max_len], zero-padded
+        audio_lengths - torch.LongTensor of shape [B]
+        Returns:
+        feats - torch.Tensor of shape [B, T', F'], zeros past each item's length
+        lengths - torch.LongTensor of shape [B]
+        """
+        feats, lengths = custom_utils.batch_logfbank(
+            audio, audio_lengths, samplerate=self.audio_sample_rate
+        )  # [B, T, F]
+        feats, lengths = custom_utils.batch_stacker(
+            feats, lengths, self.cfg.stack_order_audio
+        )  # [B, T/stack_order_audio, stack_order_audio*F]
+        if self.cfg.normalize:
+            with torch.no_grad():
+                feats = F.layer_norm(feats, feats.shape[-1:])
+        return feats, lengths
+
+    def preprocess_audio(self, audio, audio_sample_rate):
+        # audio: (audio_channels, audio_length), where audio_channels is usually 1 or 2
+        if len(audio.shape) >= 3:
+            raise NotImplementedError(
+                f"input should be single sample, not a batch! shape of audio input to preprocess_audio: {audio.shape}"
+            )
+        elif len(audio.shape) == 2:
+            assert (
+                audio.shape[0] == 1 or audio.shape[0] == 2
+            ), f"wrong audio shape to the preprocess_audio method: {audio.shape}"
+            audio = audio.mean(0)
+        # it can indeed do batch processing
+        if audio_sample_rate != self.audio_sample_rate:
+            audio = audio_ops.resample(
+                audio, audio_sample_rate, self.audio_sample_rate
+            )
+        audio = audio.float()
+        in_data, _ = self.batch_preprocess_audio(
+            audio.unsqueeze(0), torch.LongTensor([len(audio)])
+        )
+
+        return in_data[0]  # TxF
+
+    def preprocess_audio_batch(self, audio, audio_sample_rates):
+        """
+        preprocess_audio for a whole batch, used by the runner's batched preprocessing
+        audio: list of (audio_channels, audio_length) or (audio_length,) waveforms
+        """
+        wavs = [wav.mean(0) if len(wav.shape) == 2 else wav for wav in audio]
+        wavs = [
+            audio_ops.resample(wav, sample_rate, self.audio_sample_rate).float()
+            for wav, sample_rate in zip(wavs, audio_sample_rates)
+        ]
+        lengths = torch.LongTensor([len(wav) for wav in wavs])
+        feats, lengths = self.batch_preprocess_audio(
+            pad_sequence(wavs, batch_first=True), lengths
+        )
+        return [feat[:length] for feat, length in zip(feats, lengths.tolist())]  # TxF
+
+
+class UpstreamExpert(AudioPreprocessMixin, UpstreamBase):
     def __init__(self, ckpt, **kwargs):
         super().__init__(**kwargs)
         assert version.parse(fairseq.__version__) > version.parse(
@@ -56,16 +122,13 @@ class UpstreamExpert(UpstreamBase):
         assert (
             self.video_frame_rate == cfg.sample_rate
         ), f"video sample rate should equal to the task sample rate, but it's not, video_sample_rate: {self.video_frame_rate}, task_cfg.sample_rate: {self.cfg.sample_rate}"
-        self.transform = custom_utils.Compose(
-            [
-                custom_utils.Normalize(0.0, 255.0),
-                custom_utils.CenterCrop((88, 88)),
-                custom_utils.Normalize(0.421, 0.165),
-            ]
-        )
+        self.video_crop_size = (88, 88)
+        self.video_mean = 0.421
+        self.video_std = 0.165
 
         self.model.feature_grad_mult = 0.0
         self.model.encoder.layerdrop = 0.0
+        self.feature_selection = None
 
         if len(self.hooks) == 0:
             module_name = "self.model.encoder.layers"
@@ -85,90 +148,39 @@ class UpstreamExpert(UpstreamBase):
 
             self.hook_postprocess = postprocess
 
-    def stacker(self, feats, stack_order):
+    def set_feature_selection(self, feature_selection):
         """
-        TODO: need to make this a batch processing method
-        Concatenating consecutive audio frames
-        Args:
-        feats - numpy.ndarray of shape [T, F]
-        stack_order - int (number of neighboring frames to concatenate
-        Returns:
-        feats - numpy.ndarray of shape [T', F']
+        audio_feats / video_feats only need the frontend of their own modality,
+        so the other frontend and the transformer encoder are skipped for them
         """
-        feat_dim = feats.shape[1]
-        if len(feats) % stack_order != 0:
-            res = stack_order - len(feats) % stack_order
-            res = np.zeros([res, feat_dim]).astype(feats.dtype)
-            feats = np.concatenate([feats, res], axis=0)
-        feats = feats.reshape((-1, stack_order, feat_dim)).reshape(
-            -1, stack_order * feat_dim
-        )
-        return feats
+        self.feature_selection = feature_selection
 
-    def preprocess_audio(self, audio, audio_sample_rate):
-        # audio: (audio_channels, audio_length), where audio_channels is usually 1 or 2
-        # since using av-hubert native implementation, needs to work with numpy objects
-        orig_device = audio.device
-        audio = audio.cpu()
-        if len(audio.shape) >= 3:
-            raise NotImplementedError(
-                f"input should be single sample, not a batch! shape of audio input to preprocess_audio: {audio.shape}"
-            )
-        elif len(audio.shape) == 2:
-            assert (
-                audio.shape[0] == 1 or audio.shape[0] == 2
-            ), f"wrong audio shape to the preprocess_audio method: {audio.shape}"
-            audio = audio.mean(0)
-        # it can indeed do batch processing
-        if audio_sample_rate != self.audio_sample_rate:
-            audio = torchaudio.functional.resample(
-                audio, audio_sample_rate, self.audio_sample_rate
-            )
-        audio_feats = custom_utils.logfbank(
-            audio, samplerate=self.audio_sample_rate
-        ).astype(
-            np.float32
-        )  # [T, F]
-        in_data = self.stacker(audio_feats, self.cfg.stack_order_audio)
-        # [T/stack_order_audio, stack_order_audio*F]
-        in_data = torch.from_numpy(in_data.astype(np.float32))
-        if self.cfg.normalize:
-            with torch.no_grad():
-                in_data = F.layer_norm(in_data, in_data.shape[1:])
-
-        return in_data.to(orig_device)  # TxF
+    def dropped_modality(self):
+        """
+        The modality always zeroed by modality dropout (avhubert_audio / avhubert_video),
+        whose frontend does not need to be computed
+        """
+        if self.model.modality_dropout >= 1 and self.model.audio_dropout in (0, 1):
+            return "audio" if self.model.audio_dropout == 1 else "video"
+        return None
 
     def preprocess_video(self, video, video_frame_rate):
         # video: (video_length, video_channels, height, width), where video_channels is usually 3 for RGB or 1 for greyscale
         # avhubert will make image and audio have the same framerate so we can add them or concat them in feature dimension. image sample rate if 25Hz, audio sample rate is 100Hz (originally 16kHz, but after fbank it's 100Hz), four neighboring audio sample is stacked to get
-        # since using av-hubert native implementation, needs to work with numpy objects
-        orig_device = video.device
-        # Resample video
-        # (from https://github.com/pytorch/vision/blob/5b07d6c9c6c14cf88fc545415d63021456874744/torchvision/datasets/video_utils.py#L278)
-        step = float(video_frame_rate) / self.video_frame_rate
-        if step.is_integer():
-            # optimization: if step is integer, don't need to perform
-            # advanced indexing
-            step = int(step)
-            idxs = slice(None, None, step)
-        else:
-            num_frames = max(int(len(video) / step), 1)
-            idxs = torch.arange(num_frames, dtype=torch.float32) * step
-            idxs = idxs.floor().to(torch.int64)
-        video = video[idxs]
-
-        # Transform to greyscale
-        if video.shape[1] == 3:
-            video = 0.2989 * video[:, 0] + 0.587 * video[:, 1] + 0.114 * video[:, 2]
-        else:
-            video = video.mean(dim=1)
-        feats = self.transform(video)
+        # Resample, crop, transform to greyscale and normalize
+        feats = video_ops.transform(
+            video,
+            video_frame_rate,
+            self.video_frame_rate,
+            crop=self.video_crop_size,
+            grey=True,
+            mean=self.video_mean,
+            std=self.video_std,
+            scale=255.0,
+        )
 
         # T, H, W
-        if isinstance(feats, np.ndarray):
-            return torch.from_numpy(feats).to(orig_device)
-        elif isinstance(feats, torch.Tensor):
-            return feats.to(orig_device)
+        return feats
 
     def forward(self, processed_data):
         device = processed_data[0][0].device
@@ -198,6 +210,20 @@ class UpstreamExpert(UpstreamBase):
             "audio": padded_audio.transpose(1, 2),
             "video": padded_video.unsqueeze(dim=1),
         }
+
+        dropped = self.dropped_modality()
+        if self.feature_selection in ("audio_feats", "video_feats"):
+            # only the frontend of the selected modality is needed
+            modality = self.feature_selection.split("_")[0]
+            features = self.model.forward_features(source[modality], modality=modality)
+            if modality == dropped:
+                features = 0 * features
+            return {self.feature_selection: features.transpose(1, 2)}
+
+        if dropped is not None:
+            # AVHubertModel fills in zeros for the missing modality
+            source[dropped] = None
+
         result = self.model(
             source, padding_mask=padding_mask, mask=False, features_only=True
         )
@@ -207,7 +233,7 @@ class UpstreamExpert(UpstreamBase):
             # fusion_feats are handled by UpstreamBase's hooks
         }
 
-class FinetunedUpstreamExpert(UpstreamBase):
+class FinetunedUpstreamExpert(AudioPreprocessMixin, UpstreamBase):
     def __init__(self, ckpt, **kwargs):
         super().__init__(**kwargs)
         assert version.parse(fairseq.__version__) > version.parse(
@@ -244,16 +270,13 @@ class FinetunedUpstreamExpert(UpstreamBase):
         assert (
             self.video_frame_rate == cfg.sample_rate
         ), f"video sample rate should equal to the task sample rate, but it's not, video_sample_rate: {self.video_frame_rate}, task_cfg.sample_rate: {self.cfg.sample_rate}"
-        self.transform = custom_utils.Compose(
-            [
-                custom_utils.Normalize(0.0, 255.0),
-                custom_utils.CenterCrop((88, 88)),
-                custom_utils.Normalize(0.421, 0.165),
-            ]
-        )
+        self.video_crop_size = (88, 88)
+        self.video_mean = 0.421
+        self.video_std = 0.165
 
         self.model.feature_grad_mult = 0.0
         self.model.encoder.layerdrop = 0.0
+        self.feature_selection = None
 
         if len(self.hooks) == 0:
             module_name = "self.model.encoder.layers"
@@ -273,90 +296,39 @@ class FinetunedUpstreamExpert(UpstreamBase):
 
             self.hook_postprocess = postprocess
 
-    def stacker(self, feats, stack_order):
+    def set_feature_selection(self, feature_selection):
         """
-        TODO: need to make this a batch processing method
-        Concatenating consecutive audio frames
-        Args:
-        feats - numpy.ndarray of shape [T, F]
-        stack_order - int (number of neighboring frames to concatenate
-        Returns:
-        feats - numpy.ndarray of shape [T', F']
+        audio_feats / video_feats only need the frontend of their own modality,
+        so the other frontend and the transformer encoder are skipped for them
         """
-        feat_dim = feats.shape[1]
-        if len(feats) % stack_order != 0:
-            res = stack_order - len(feats) % stack_order
-            res = np.zeros([res, feat_dim]).astype(feats.dtype)
-            feats = np.concatenate([feats, res], axis=0)
-        feats = feats.reshape((-1, stack_order, feat_dim)).reshape(
-            -1, stack_order * feat_dim
-        )
-        return feats
+        self.feature_selection = feature_selection
 
-    def preprocess_audio(self, audio, audio_sample_rate):
-        # audio: (audio_channels, audio_length), where audio_channels is usually 1 or 2
-        # since using av-hubert native implementation, needs to work with numpy objects
-        orig_device = audio.device
-        audio = audio.cpu()
-        if len(audio.shape) >= 3:
-            raise NotImplementedError(
-                f"input should be single sample, not a batch! shape of audio input to preprocess_audio: {audio.shape}"
-            )
-        elif len(audio.shape) == 2:
-            assert (
-                audio.shape[0] == 1 or audio.shape[0] == 2
-            ), f"wrong audio shape to the preprocess_audio method: {audio.shape}"
-            audio = audio.mean(0)
-        # it can indeed do batch processing
-        if audio_sample_rate != self.audio_sample_rate:
-            audio = torchaudio.functional.resample(
-                audio, audio_sample_rate, self.audio_sample_rate
-            )
-        audio_feats = custom_utils.logfbank(
-            audio, samplerate=self.audio_sample_rate
-        ).astype(
-            np.float32
-        )  # [T, F]
-        in_data = self.stacker(audio_feats, self.cfg.stack_order_audio)
-        # [T/stack_order_audio, stack_order_audio*F]
-        in_data = torch.from_numpy(in_data.astype(np.float32))
-        if self.cfg.normalize:
-            with torch.no_grad():
-                in_data = F.layer_norm(in_data, in_data.shape[1:])
-
-        return in_data.to(orig_device)  # TxF
+    def dropped_modality(self):
+        """
+        The modality always zeroed by modality dropout (avhubert_audio / avhubert_video),
+        whose frontend does not need to be computed
+        """
+        if self.model.modality_dropout >= 1 and self.model.audio_dropout in (0, 1):
+            return "audio" if self.model.audio_dropout == 1 else "video"
+        return None
 
     def preprocess_video(self, video, video_frame_rate):
         # video: (video_length, video_channels, height, width), where video_channels is usually 3 for RGB or 1 for greyscale
         # avhubert will make image and audio have the same framerate so we can add them or concat them in feature dimension. image sample rate if 25Hz, audio sample rate is 100Hz (originally 16kHz, but after fbank it's 100Hz), four neighboring audio sample is stacked to get
-        # since using av-hubert native implementation, needs to work with numpy objects
-        orig_device = video.device
-        # Resample video
-        # (from https://github.com/pytorch/vision/blob/5b07d6c9c6c14cf88fc545415d63021456874744/torchvision/datasets/video_utils.py#L278)
-        step = float(video_frame_rate) / self.video_frame_rate
-        if step.is_integer():
-            # optimization: if step is integer, don't need to perform
-            # advanced indexing
-            step = int(step)
-            idxs = slice(None, None, step)
-        else:
-            num_frames = max(int(len(video) / step), 1)
-            idxs = torch.arange(num_frames, dtype=torch.float32) * step
-            idxs = idxs.floor().to(torch.int64)
-        video = video[idxs]
-
-        # Transform to greyscale
-        if video.shape[1] == 3:
-            video = 0.2989 * video[:, 0] + 0.587 * video[:, 1] + 0.114 * video[:, 2]
-        else:
-            video = video.mean(dim=1)
-        feats = self.transform(video)
+        # Resample, crop, transform to greyscale and normalize
+        feats = video_ops.transform(
+            video,
+            video_frame_rate,
+            self.video_frame_rate,
+            crop=self.video_crop_size,
+            grey=True,
+            mean=self.video_mean,
+            std=self.video_std,
+            scale=255.0,
+        )
 
         # T, H, W
-        if isinstance(feats, np.ndarray):
-            return torch.from_numpy(feats).to(orig_device)
-        elif isinstance(feats, torch.Tensor):
-            return feats.to(orig_device)
+        return feats
 
     def forward(self, processed_data):
         device = processed_data[0][0].device
@@ -386,6 +358,20 @@ class FinetunedUpstreamExpert(UpstreamBase):
             "audio": padded_audio.transpose(1, 2),
             "video": padded_video.unsqueeze(dim=1),
         }
+
+        dropped = self.dropped_modality()
+        if self.feature_selection in ("audio_feats", "video_feats"):
+            # only the frontend of the selected modality is needed
+            modality = self.feature_selection.split("_")[0]
+            features = self.model.forward_features(source[modality], modality=modality)
+            if modality == dropped:
+                features = 0 * features
+            return {self.feature_selection: features.transpose(1, 2)}
+
+        if dropped is not None:
+            # AVHubertModel fills in zeros for the missing modality
+            source[dropped] = None
+
         result = self.model(
             source, padding_mask=padding_mask, mask=False, features_only=True
         )
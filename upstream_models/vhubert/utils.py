@@ -682,3 +682,82 @@ def logfbank(
         winfunc,
     )
     return np.log(feat)
+
+
+#### batched torch counterparts of logfbank and the experts' stacker
+from functools import lru_cache
+
+import torch.nn.functional as F
+
+
+@lru_cache(maxsize=None)
+def cached_filterbanks(nfilt=20, nfft=512, samplerate=16000, lowfreq=0, highfreq=None):
+    """get_filterbanks as a torch tensor, computed once per configuration"""
+    return torch.from_numpy(get_filterbanks(nfilt, nfft, samplerate, lowfreq, highfreq))
+
+
+def batch_logfbank(
+    signals,
+    lengths,
+    samplerate=16000,
+    winlen=0.025,
+    winstep=0.01,
+    nfilt=26,
+    nfft=512,
+    lowfreq=0,
+    highfreq=None,
+    preemph=0.97,
+):
+    """Compute logfbank (with the default rectangular window) for a batch of signals.
+    :param signals: a (batch_size, max_len) tensor of zero-padded audio signals.
+    :param lengths: a (batch_size,) tensor with the number of samples of each signal.
+    :returns: a (batch_size, max_frames, nfilt) tensor and the number of frames of each signal.
+        Frames past a signal's number of frames are zeros.
+    """
+    highfreq = highfreq or samplerate / 2
+    frame_len = int(round_half_up(winlen * samplerate))
+    frame_step = int(round_half_up(winstep * samplerate))
+    lengths = lengths.to(signals.device)
+
+    # preemphasis, the padding stays zero as framesig pads after the filter
+    signals = torch.cat(
+        [signals[:, :1], signals[:, 1:] - preemph * signals[:, :-1]], dim=1
+    )
+    positions = torch.arange(signals.size(1), device=signals.device)
+    signals = signals * (positions < lengths.unsqueeze(1))
+
+    # same number of frames as framesig
+    num_frames = 1 + torch.div(
+        (lengths - frame_len).clamp(min=0) + frame_step - 1,
+        frame_step,
+        rounding_mode="floor",
+    )
+    padlen = (int(num_frames.max()) - 1) * frame_step + frame_len
+    if padlen > signals.size(1):
+        signals = F.pad(signals, (0, padlen - signals.size(1)))
+    frames = signals[:, :padlen].unfold(1, frame_len, frame_step)
+
+    pspec = 1.0 / nfft * torch.fft.rfft(frames, n=nfft).abs().pow(2)
+    fb = cached_filterbanks(nfilt, nfft, samplerate, lowfreq, highfreq)
+    feat = pspec.matmul(fb.t().to(device=pspec.device, dtype=pspec.dtype))
+    feat = torch.where(feat == 0, torch.full_like(feat, np.finfo(float).eps), feat)
+    feat = feat.log()
+
+    frame_mask = torch.arange(feat.size(1), device=feat.device) < num_frames.unsqueeze(1)
+    return feat * frame_mask.unsqueeze(-1), num_frames
+
+
+def batch_stacker(feats, lengths, stack_order):
+    """Concatenate stack_order consecutive frames, for a batch of features.
+    :param feats: a (batch_size, T, F) tensor, zeros past each item's length.
+    :param lengths: a (batch_size,) tensor with the number of frames of each item.
+    :param stack_order: number of neighboring frames to concatenate.
+    :returns: a (batch_size, ceil(T / stack_order), stack_order * F) tensor and the new lengths.
+    """
+    batch_size, num_frames, feat_dim = feats.shape
+    res = -num_frames % stack_order
+    if res != 0:
+        feats = F.pad(feats, (0, 0, 0, res))
+    feats = feats.reshape(batch_size, -1, stack_order * feat_dim)
+    lengths = torch.div(lengths + stack_order - 1, stack_order, rounding_mode="floor")
+    return feats, lengths
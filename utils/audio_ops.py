@@ -0,0 +1,52 @@
+"""
+Shared audio preprocessing for the upstream experts: a process-wide registry of
+resampling kernels, so the sinc kernel for a (orig_freq, new_freq) pair is only
+built once per dtype and device, and a batched resampling entry point.
+"""
+
+import math
+
+import torch
+import torchaudio
+
+_RESAMPLERS = {}
+
+
+def get_resampler(orig_freq, new_freq, dtype=torch.float32, device="cpu"):
+    """
+    Cached torchaudio.transforms.Resample, keyed by (orig_freq, new_freq, dtype, device)
+    """
+    key = (int(orig_freq), int(new_freq), dtype, torch.device(device))
+    resampler = _RESAMPLERS.get(key)
+    if resampler is None:
+        resampler = torchaudio.transforms.Resample(key[0], key[1]).to(device=device, dtype=dtype)
+        _RESAMPLERS[key] = resampler
+    return resampler
+
+
+def resample(waveform, orig_freq, new_freq):
+    """
+    Same as torchaudio.functional.resample, for waveforms of shape (..., time),
+    e.g. (audio_length,), (audio_channels, audio_length) or a batch
+    """
+    if int(orig_freq) == int(new_freq):
+        return waveform
+    return get_resampler(orig_freq, new_freq, waveform.dtype, waveform.device)(waveform)
+
+
+def resample_batch(waveforms, lengths, orig_freq, new_freq):
+    """
+    Resample a zero-padded batch (batch_size, max_len) in one call
+    Returns the resampled batch, zero past each clip's end, and the new lengths
+    """
+    if int(orig_freq) == int(new_freq):
+        return waveforms, lengths
+    waveforms = resample(waveforms, orig_freq, new_freq)
+    gcd = math.gcd(int(orig_freq), int(new_freq))
+    lengths = torch.div(
+        lengths * (int(new_freq) // gcd) + (int(orig_freq) // gcd) - 1,
+        int(orig_freq) // gcd,
+        rounding_mode="floor",
+    )
+    mask = torch.arange(waveforms.size(-1), device=waveforms.device) < lengths.to(waveforms.device).unsqueeze(1)
+    return waveforms * mask, lengths
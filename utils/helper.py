@@ -60,6 +60,22 @@ def get_model_state(model):
     return model.state_dict()
 
 
+def get_worker_kwargs(datarc):
+    """
+    DataLoader worker options from a downstream datarc: the runner reuses each
+    DataLoader, so workers are kept alive, with prefetch_factor (default 2) batches
+    in flight per worker
+    """
+    num_workers = datarc["num_workers"]
+    if num_workers == 0:
+        return {"num_workers": 0}
+    return {
+        "num_workers": num_workers,
+        "persistent_workers": True,
+        "prefetch_factor": datarc.get("prefetch_factor", 2),
+    }
+
+
 def show(*args, **kwargs):
     if is_leader_process():
         print(*args, **kwargs)
@@ -0,0 +1,187 @@
+"""
+Metric accumulators for the downstream experts' records. They are updated in place
+with device tensors on every forward and only synced to the host by compute(),
+once per log_records, instead of a loss.item() / .cpu().tolist() on every batch.
+
+    running_mean(records, "loss").update(loss)
+    running_mean(records, "acc").update(predicted_classid == labels)
+    ...
+    average = mean(records["acc"])  # in log_records
+"""
+
+import torch
+import torch.distributed as dist
+
+
+class RunningMean:
+    """
+    Mean of every value passed to update, as a running sum and count
+    """
+
+    def __init__(self):
+        self.total = None
+        self.count = 0
+
+    def update(self, values):
+        values = values.detach()
+        total = values.sum(dtype=torch.float64)
+        self.total = total if self.total is None else self.total + total
+        self.count += values.numel()
+
+    def compute(self):
+        if self.count == 0:
+            return float("nan")
+        return (self.total / self.count).item()
+
+
+class ConfusionMatrix:
+    """
+    (num_classes, num_classes) counts of (label, prediction) pairs, compute() is the accuracy
+    """
+
+    def __init__(self, num_classes):
+        self.num_classes = num_classes
+        self.matrix = None
+
+    def update(self, predicted_classid, labels):
+        pairs = labels.view(-1) * self.num_classes + predicted_classid.view(-1)
+        counts = torch.bincount(pairs, minlength=self.num_classes**2)
+        counts = counts.view(self.num_classes, self.num_classes)
+        self.matrix = counts if self.matrix is None else self.matrix + counts
+
+    def compute(self):
+        if self.matrix is None:
+            return float("nan")
+        return (self.matrix.diagonal().sum() / self.matrix.sum()).item()
+
+
+def average_precision(scores, targets):
+    """
+    Per-class average precision of (num_samples, num_classes) scores and binary targets,
+    same as sklearn.metrics.average_precision_score(targets, scores, average=None),
+    with 0 for the classes without positives
+    Returns a (num_classes,) tensor
+    """
+    num_samples = scores.size(0)
+    scores, order = scores.t().sort(dim=1, descending=True)
+    targets = targets.t().gather(1, order).float()
+    positions = torch.arange(num_samples, device=scores.device).expand_as(scores)
+    precision = targets.cumsum(dim=1) / (positions + 1)
+
+    # tied scores are a single threshold: every sample of a run of equal scores
+    # gets the precision at the end of the run
+    run_end = torch.ones_like(scores, dtype=torch.bool)
+    run_end[:, :-1] = scores[:, :-1] != scores[:, 1:]
+    run_end = torch.where(run_end, positions, torch.full_like(positions, num_samples))
+    run_end = run_end.flip(1).cummin(dim=1).values.flip(1)
+    precision = precision.gather(1, run_end)
+
+    num_positives = targets.sum(dim=1)
+    return (targets * precision).sum(dim=1) / num_positives.clamp(min=1)
+
+
+class AveragePrecision:
+    """
+    Macro average precision over every (scores, targets) batch passed to update, as
+    sklearn's average_precision_score(targets, scores, average="macro"). The batches are
+    written into (capacity, num_classes) buffers allocated on the scores' device at the
+    first update, and grown if more than capacity samples come before reset()
+    """
+
+    def __init__(self, capacity, num_classes):
+        self.capacity = capacity
+        self.num_classes = num_classes
+        self.scores = None
+        self.targets = None
+        self.count = 0
+
+    def _allocate(self, capacity, device):
+        scores = torch.empty((capacity, self.num_classes), dtype=torch.float32, device=device)
+        targets = torch.empty((capacity, self.num_classes), dtype=torch.bool, device=device)
+        if self.count > 0:
+            scores[: self.count] = self.scores[: self.count]
+            targets[: self.count] = self.targets[: self.count]
+        self.scores, self.targets = scores, targets
+
+    def update(self, scores, targets):
+        batch_size = scores.size(0)
+        if self.scores is None:
+            self._allocate(max(self.capacity, batch_size), scores.device)
+        elif self.count + batch_size > self.scores.size(0):
+            self._allocate(max(2 * self.scores.size(0), self.count + batch_size), scores.device)
+
+        self.scores[self.count : self.count + batch_size] = scores.detach()
+        self.targets[self.count : self.count + batch_size] = targets != 0
+        self.count += batch_size
+
+    def reset(self):
+        self.count = 0
+
+    def all_gather(self):
+        """
+        (scores, targets) of every process, must be called by all of them under DDP,
+        once each has had an update
+        """
+        scores, targets = self.scores[: self.count], self.targets[: self.count]
+        if not dist.is_initialized():
+            return scores, targets
+
+        count = torch.tensor([self.count], device=scores.device)
+        counts = [torch.zeros_like(count) for _ in range(dist.get_world_size())]
+        dist.all_gather(counts, count)
+        counts = [int(c) for c in counts]
+        # all_gather takes tensors of the same shape, pad to the largest count
+        padded_scores = scores.new_zeros((max(counts), self.num_classes))
+        padded_scores[: self.count] = scores
+        padded_targets = padded_scores.new_zeros((max(counts), self.num_classes), dtype=torch.uint8)
+        padded_targets[: self.count] = targets
+        all_scores = [torch.empty_like(padded_scores) for _ in counts]
+        all_targets = [torch.empty_like(padded_targets) for _ in counts]
+        dist.all_gather(all_scores, padded_scores)
+        dist.all_gather(all_targets, padded_targets)
+        scores = torch.cat([s[:c] for s, c in zip(all_scores, counts)])
+        targets = torch.cat([t[:c] for t, c in zip(all_targets, counts)])
+        return scores, targets.bool()
+
+    def compute(self, gather=False):
+        """
+        gather: include the samples of every process (see all_gather), e.g. for an
+        evaluation run by every DDP process, the runner evaluates on the leader only
+        """
+        if gather:
+            scores, targets = self.all_gather()
+        elif self.count > 0:
+            scores, targets = self.scores[: self.count], self.targets[: self.count]
+        else:
+            return float("nan")
+        if scores.size(0) == 0:
+            return float("nan")
+        return average_precision(scores, targets).mean().item()
+
+
+def running_mean(records, key):
+    """
+    The RunningMean in records[key], created on first use
+    (records is the runner's defaultdict(list))
+    """
+    if not isinstance(records.get(key), RunningMean):
+        records[key] = RunningMean()
+    return records[key]
+
+
+def confusion_matrix(records, key, num_classes):
+    """
+    The ConfusionMatrix in records[key], created on first use
+    """
+    if not isinstance(records.get(key), ConfusionMatrix):
+        records[key] = ConfusionMatrix(num_classes)
+    return records[key]
+
+
+def mean(values):
+    """
+    The average of a records entry, an accumulator or a list of numbers
+    """
+    if isinstance(values, (RunningMean, ConfusionMatrix, AveragePrecision)):
+        return values.compute()
+    return torch.FloatTensor(values).mean().item()
@@ -1,5 +1,7 @@
 import warnings
 
+import torch
+
 def preprocess(model, frames, wav, video_fps, audio_sr, device):
     if hasattr(model, 'preprocess') and callable(model.preprocess):
         # for AVBERT
@@ -15,4 +17,43 @@ def preprocess(model, frames, wav, video_fps, audio_sr, device):
         else:
             warnings.warn('Model does not implement preprocess_video method.')
             processed_frames = frames
-    return processed_wav.to(device), processed_frames.to(device),
\ No newline at end of file
+    return processed_wav.to(device), processed_frames.to(device),
+
+class RawInput:
+    """
+    Passed to the datasets as preprocess_audio / preprocess_video in the runner's
+    batched preprocessing mode: the DataLoader workers only decode, and return the
+    raw waveform / (uint8) frames with their rate for batch_preprocess
+    """
+
+    def __call__(self, data, rate):
+        return data, rate
+
+
+def batch_preprocess(model, wavs, frames, device):
+    """
+    Batched preprocessing stage run right before the upstream.
+    wavs: list of (wav, audio_sr), frames: list of (frames, video_fps), as returned by RawInput
+    The raw data is moved to device before any conversion, then preprocessed there,
+    for the whole batch at once when the upstream defines
+    preprocess_audio_batch(wavs, audio_srs) / preprocess_video_batch(frames, video_fps)
+    Upstreams whose preprocessing only runs on the cpu set device_preprocess = False,
+    the runner then does not use this stage
+    Returns the [(processed_wav, processed_frames), ...] source of the upstream
+    """
+    wavs, audio_srs = zip(*wavs)
+    frames, video_fps = zip(*frames)
+    wavs = [wav.to(device, non_blocking=True) for wav in wavs]
+    frames = [frame.to(device, non_blocking=True) for frame in frames]
+
+    with torch.no_grad():
+        if hasattr(model, 'preprocess_audio_batch') and callable(model.preprocess_audio_batch):
+            processed_wavs = model.preprocess_audio_batch(wavs, audio_srs)
+        else:
+            processed_wavs = [model.preprocess_audio(wav, sr) for wav, sr in zip(wavs, audio_srs)]
+        if hasattr(model, 'preprocess_video_batch') and callable(model.preprocess_video_batch):
+            processed_frames = model.preprocess_video_batch(frames, video_fps)
+        else:
+            processed_frames = [model.preprocess_video(frame, fps) for frame, fps in zip(frames, video_fps)]
+
+    return [(wav.float(), frame) for wav, frame in zip(processed_wavs, processed_frames)]
@@ -0,0 +1,125 @@
+"""
+Shared video preprocessing for the upstream experts: frame-rate resampling,
+resizing, center cropping, greyscale conversion and normalization in one pass.
+Videos are (video_length, video_channels, height, width), usually uint8.
+"""
+
+from typing import Sequence, Tuple, Union
+
+import torch
+import torch.nn.functional as F
+import torchvision
+
+GREY_WEIGHTS = (0.2989, 0.587, 0.114)
+
+
+def resample_indices(num_frames: int, orig_fps: float, new_fps: float, min_frames: int = 1):
+    """
+    Frames to keep to resample a video from orig_fps to new_fps
+    (from https://github.com/pytorch/vision/blob/5b07d6c9c6c14cf88fc545415d63021456874744/torchvision/datasets/video_utils.py#L278)
+    Returns a slice, or a LongTensor of at least min_frames indices
+    """
+    step = float(orig_fps) / new_fps
+    if step.is_integer():
+        # optimization: if step is integer, don't need to perform
+        # advanced indexing
+        return slice(None, None, int(step))
+    num_frames = max(int(num_frames / step), min_frames)
+    idxs = torch.arange(num_frames, dtype=torch.float32) * step
+    return idxs.floor().to(torch.int64)
+
+
+def _as_tensor(value, like):
+    value = torch.as_tensor(value, dtype=like.dtype, device=like.device)
+    return value.view(-1, 1, 1) if value.dim() == 1 else value
+
+
+def _center_crop(video, size):
+    # crops by slicing and zero-pads the sides smaller than size, offsets as (h - th) // 2
+    h, w = video.shape[-2:]
+    th, tw = size
+    top, left = max((h - th) // 2, 0), max((w - tw) // 2, 0)
+    video = video[..., top : top + th, left : left + tw]
+    if th > h or tw > w:
+        pad_h, pad_w = max(th - h, 0), max(tw - w, 0)
+        video = F.pad(video, (pad_w // 2, pad_w - pad_w // 2, pad_h // 2, pad_h - pad_h // 2))
+    return video
+
+
+def _resize(video, size, short_side, crop, antialias):
+    """
+    Bilinear resize of (T, C, H, W) frames to size (h, w), or of the short side
+    to short_side, then center crop to crop
+    """
+    if size is None:
+        h, w = video.shape[-2:]
+        size = (short_side, int(short_side * w / h)) if h <= w else (int(short_side * h / w), short_side)
+    kwargs = {} if antialias is None else {"antialias": antialias}
+    video = torchvision.transforms.functional.resize(video, list(size), **kwargs)
+    if crop is not None:
+        video = _center_crop(video, crop)
+    return video
+
+
+def transform(
+    video: torch.Tensor,
+    orig_fps: float = None,
+    new_fps: float = None,
+    min_frames: int = 1,
+    size: Tuple[int, int] = None,
+    short_side: int = None,
+    crop: Tuple[int, int] = None,
+    grey: bool = False,
+    mean: Union[float, Sequence[float]] = None,
+    std: Union[float, Sequence[float]] = None,
+    scale: float = 1.0,
+    antialias: bool = None,
+    resize_first: bool = False,
+):
+    """
+    Fused video preprocessing, every step is optional:
+        1. resample from orig_fps to new_fps (resample_indices)
+        2. greyscale conversion (GREY_WEIGHTS for RGB, channel mean otherwise)
+        3. bilinear resize to size (h, w), or of the short side to short_side
+        4. center crop to crop (h, w)
+        5. (x / scale - mean) / std, mean and std are scalars or per channel
+    Frames are selected and cropped before the float conversion, greyscale conversion
+    is done before resizing (both are linear), so only the kept pixels are converted.
+    resize_first resizes (and crops) before the float and greyscale conversions instead,
+    in the input's dtype, e.g. for uint8 frames rounded after resizing as cv2 / PIL do.
+    Returns a float tensor, (T, C, H, W), or (T, H, W) when grey
+    """
+    if orig_fps is not None and new_fps is not None:
+        video = video[resample_indices(len(video), orig_fps, new_fps, min_frames)]
+
+    resize = size is not None or short_side is not None
+    if crop is not None and not resize:
+        video = _center_crop(video, crop)
+
+    if resize and resize_first:
+        video = _resize(video, size, short_side, crop, antialias)
+
+    video = video.float()
+    if grey:
+        if video.shape[1] == 3:
+            video = torch.einsum("tchw,c->thw", video, video.new_tensor(GREY_WEIGHTS))
+        else:
+            video = video.mean(dim=1)
+        video = video.unsqueeze(1)
+
+    if resize and not resize_first:
+        video = _resize(video, size, short_side, crop, antialias)
+
+    # (x / scale - mean) / std == x * (1 / (scale * std)) - mean / std
+    # (the first op is out-of-place, float input may be a view of the caller's video)
+    if std is not None:
+        std = _as_tensor(std, video)
+        video = video * (1.0 / (scale * std))
+        if mean is not None:
+            video = video.sub_(_as_tensor(mean, video) / std)
+    elif mean is not None or scale != 1.0:
+        video = video / scale
+        if mean is not None:
+            video = video.sub_(_as_tensor(mean, video))
+
+    return video.squeeze(1) if grey else video